@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+ File Name : bench_game.py
+
+Measures what the game itself costs per tick with a given number of
+players, without any network in the way. The players live in a
+HeadlessMud, make their characters and then each type a command from a
+weighted mix every tick. The game runs on a virtual clock, so its
+timers go off as they would in a real game of the same length.
+
+usage: python bench/bench_game.py [--players N] [--ticks N] [--profile]
+
+"""
+import argparse
+import contextlib
+import cProfile
+import os
+import pstats
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from lib.sim import Sim, VirtualClock  # noqa: E402
+from server.headless import HeadlessMud  # noqa: E402
+from server.ticker import Ticker  # noqa: E402
+import smud  # noqa: E402
+
+# what the players type, and how often
+COMMANDS = {
+    "look": 30,
+    "go north": 5,
+    "go south": 5,
+    "go east": 5,
+    "go west": 5,
+    "stats": 10,
+    "hp": 10,
+    "xp": 5,
+    "inv": 5,
+    "list": 5,
+    "say hello there": 10,
+    "attack goblin": 5,
+}
+
+
+def _percentile(values, fraction):
+    """ the value 'fraction' of the way up the sorted values """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _setup(args):
+    """ a game on a headless server, on a virtual clock """
+    clock = VirtualClock(time.time())
+    # the players type a command every tick, far faster than the rate
+    # limits let anyone, so those are off
+    mud = HeadlessMud(keep_output=args.keep_output, rate_limits={},
+                      max_lines=args.actions_per_round, clock=clock)
+    game = smud.Game(mud, actions_per_round=args.actions_per_round,
+                     sim=Sim(args.seed, clock), render=args.render)
+    mud.on_new_player(game.new_player)
+    mud.on_player_left(game.player_left)
+    mud.on_command(game.new_command)
+
+    ticker = Ticker(clock=clock, sleep=clock.sleep)
+    smud.add_phases(ticker, mud, game, args)
+    return clock, mud, game, ticker
+
+
+def _tick(clock, ticker, period):
+    """ run one network tick's worth of phases, returning its wall time """
+    start = time.perf_counter()
+    ticker.run_due()
+    elapsed = time.perf_counter() - start
+    clock.sleep(period)
+    return elapsed
+
+
+def _run(args, profiler=None):
+    """ make the characters, then play; returns the per-tick wall times """
+    clock, mud, game, ticker = _setup(args)
+    period = 1 / args.net_rate
+    rng = random.Random(args.seed)
+    lines = list(COMMANDS)
+    weights = list(COMMANDS.values())
+
+    # name, species and class, one tick each
+    players = [mud.connect() for _ in range(args.players)]
+    for pid in players:
+        mud.inject(pid, f"bot{pid}\n0\n0")
+    while mud._waiting or game.queued_commands():
+        _tick(clock, ticker, period)
+
+    # only the playing is profiled, not loading the world
+    if profiler:
+        profiler.enable()
+    times = []
+    for _ in range(args.ticks):
+        for pid in players:
+            mud.inject(pid, rng.choices(lines, weights)[0])
+        times.append(_tick(clock, ticker, period))
+    if profiler:
+        profiler.disable()
+
+    return times, mud, ticker
+
+
+def main():
+    """ run the game for a while and report how long the ticks took """
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--net-rate", type=float, default=20)
+    parser.add_argument("--ai-rate", type=float, default=1)
+    parser.add_argument("--status-rate", type=float)
+    parser.add_argument("--lair-rate", type=float, default=1)
+    parser.add_argument("--actions-per-round", type=int, default=1)
+    parser.add_argument("--keep-output", action="store_true",
+                        help="keep what players are sent, as a harness would")
+    parser.add_argument("--no-render", dest="render", action="store_false",
+                        help="don't turn game events into text for anyone")
+    parser.add_argument("--profile", action="store_true",
+                        help="show where the time went")
+    args = parser.parse_args()
+
+    # the game loads its data relative to the repository
+    os.chdir(ROOT)
+
+    profiler = cProfile.Profile() if args.profile else None
+    started = time.perf_counter()
+    with open(os.devnull, "w", encoding="utf-8") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        times, mud, ticker = _run(args, profiler)
+    wall = time.perf_counter() - started
+
+    commands = args.players * args.ticks
+    total = sum(times)
+    print(f"{args.players} players, {args.ticks} ticks, "
+          f"{commands} commands in {total:.2f}s of ticks "
+          f"({wall:.2f}s with setup)")
+    print(f"  {commands / total:10.0f} commands/s, "
+          f"{mud.bytes_out / total / 1e6:.1f} MB/s of output")
+    print(f"  tick ms: mean {statistics.mean(times) * 1000:.2f}, "
+          f"p50 {_percentile(times, 0.5) * 1000:.2f}, "
+          f"p99 {_percentile(times, 0.99) * 1000:.2f}, "
+          f"max {max(times) * 1000:.2f}")
+    for name, stats in ticker.get_stats().items():
+        print(f"  {name:>10}: {stats['runs']:6} runs, "
+              f"{stats['seconds'] * 1000:9.1f}ms, "
+              f"slowest {stats['slowest'] * 1000:7.2f}ms")
+
+    if profiler:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
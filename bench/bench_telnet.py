@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+ File Name : bench_telnet.py
+
+Measures how fast Mud._process_sent_data gets through telnet input, in
+MB/s, next to the character-at-a-time parser it replaced. The old parser
+is quadratic in the length of a line, so it only gets LEGACY_BUDGET
+seconds per workload. That flatters it on the long line, whose cost only
+grows the further in it gets.
+
+usage: python bench/bench_telnet.py
+
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from server.mud import Mud  # noqa: E402
+
+PACKET = 4096
+# seconds the legacy parser may spend on one workload
+LEGACY_BUDGET = 2.0
+
+
+def _legacy_parse(client, data):
+    """ the old parser: one character at a time, state reset per call """
+    message = None
+    state = Mud._READ_STATE_NORMAL
+    for char in data:
+        if state == Mud._READ_STATE_NORMAL:
+            if ord(char) == Mud._TN_INTERPRET_AS_COMMAND:
+                state = Mud._READ_STATE_COMMAND
+            elif char == "\n":
+                message = client.buffer
+                client.buffer = ""
+            elif char == "\x08":
+                client.buffer = client.buffer[:-1]
+            else:
+                client.buffer += char
+        elif state == Mud._READ_STATE_COMMAND:
+            if ord(char) == Mud._TN_SUBNEGOTIATION_START:
+                state = Mud._READ_STATE_SUBNEG
+            elif ord(char) in (Mud._TN_WILL, Mud._TN_WONT, Mud._TN_DO,
+                               Mud._TN_DONT):
+                state = Mud._READ_STATE_COMMAND
+            else:
+                state = Mud._READ_STATE_NORMAL
+        elif state == Mud._READ_STATE_SUBNEG:
+            if ord(char) == Mud._TN_SUBNEGOTIATION_END:
+                state = Mud._READ_STATE_NORMAL
+    return message
+
+
+def _workloads():
+    """ plain commands, commands mixed with negotiation, one very long line """
+    commands = (
+        b"look\r\n",
+        b"say has anyone seen the blacksmith today?\r\n",
+        b"north\r\n",
+        b"buy long sword\r\n",
+        b"stats\r\n",
+    )
+    negotiating = (
+        b"look\r\n",
+        b"say has anyone seen the blacksmith today?\r\n",
+        b"\xff\xfd\x01north\r\n",
+        b"buy long sword\r\n",
+        b"\xff\xfa\x18\x00xterm\xff\xf0stats\r\n",
+    )
+    plain = b"".join(commands) * 20000
+    return (
+        ("plain commands", plain),
+        ("negotiation", b"".join(negotiating) * 20000),
+        ("one long line", b"x" * (len(plain) - 2) + b"\r\n"),
+    )
+
+
+def _packets(data):
+    """ split a stream up the way recv() would hand it to us """
+    return [data[i:i + PACKET] for i in range(0, len(data), PACKET)]
+
+
+def _bench_new(mud, packets):
+    client = Mud._Client(None, "", b"", 0)
+    inbuf = client.inbuf
+    start = time.perf_counter()
+    for packet in packets:
+        size = len(packet)
+        inbuf[:size] = packet
+        mud._process_sent_data(client, inbuf, size)
+    return time.perf_counter() - start
+
+
+def _bench_legacy(packets):
+    """ returns the bytes parsed within LEGACY_BUDGET and the time taken """
+    client = Mud._Client(None, "", b"", 0)
+    client.buffer = ""
+    parsed = 0
+    start = time.perf_counter()
+    for packet in packets:
+        _legacy_parse(client, packet.decode("latin1"))
+        parsed += len(packet)
+        if time.perf_counter() - start > LEGACY_BUDGET:
+            break
+    return parsed, time.perf_counter() - start
+
+
+def main():
+    """ run each parser over each workload """
+    mud = Mud(host="127.0.0.1", port=0)
+
+    print(f"{'workload':>16} {'bytes-level MB/s':>17} {'legacy MB/s':>12} "
+          f"{'speedup':>8}")
+    for name, data in _workloads():
+        packets = _packets(data)
+        new = len(data) / 1e6 / _bench_new(mud, packets)
+        parsed, seconds = _bench_legacy(packets)
+        legacy = parsed / 1e6 / seconds
+        print(f"{name:>16} {new:>17.1f} {legacy:>12.2f} "
+              f"{new / legacy:>7.0f}x")
+
+    mud.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
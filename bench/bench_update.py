@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+ File Name : bench_update.py
+
+Measures what one call to Mud.update() costs with a given number of idle
+telnet connections, next to the old approach of probing every socket and
+calling select() on it once per update.
+
+usage: python bench/bench_update.py [count ...]
+
+"""
+import os
+import resource
+import select
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from server.mud import Mud  # noqa: E402
+
+ROUNDS = 200
+
+
+def _raise_fd_limit(count):
+    """ every connection needs a descriptor on both ends """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = count * 2 + 64
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+
+def _connect(mud, port, count):
+    """ open 'count' idle clients and wait until the server has them all """
+    clients = []
+    for _ in range(count):
+        clients.append(socket.create_connection(("127.0.0.1", port)))
+        mud.update()
+        while not mud.get_new_players():
+            mud.update()
+    return clients
+
+
+def _legacy_poll(mud):
+    """ what update() used to do: a NUL probe and a select() per socket """
+    select.select([mud._listen_socket], [], [], 0)
+    for clnt in list(mud._clients.values()):
+        clnt.sock.send(b"\x00")
+        select.select([clnt.sock], [], [], 0)
+
+
+def _time(func, rounds):
+    """ average wall time of one call in microseconds """
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    """ run the benchmark for each connection count """
+    counts = [int(x) for x in sys.argv[1:]] or [10, 100, 1000]
+    _raise_fd_limit(max(counts))
+
+    print(f"{'clients':>8} {'update() us':>12} {'per-socket poll us':>21}")
+    for count in counts:
+        mud = Mud(host="127.0.0.1", port=0)
+        port = mud._listen_socket.getsockname()[1]
+        clients = _connect(mud, port, count)
+
+        update = f"{_time(mud.update, ROUNDS):.1f}"
+        try:
+            legacy = f"{_time(lambda: _legacy_poll(mud), ROUNDS):.1f}"
+        except ValueError:
+            # select() can't watch descriptors above FD_SETSIZE (1024)
+            legacy = "n/a"
+        print(f"{count:>8} {update:>12} {legacy:>21}")
+
+        mud.shutdown()
+        for clnt in clients:
+            clnt.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
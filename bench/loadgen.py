@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+"""
+ File Name : loadgen.py
+
+Load generator for capacity testing. It opens a number of real telnet
+connections to a running server, walks each one through making a
+character (name, species, class) and then has it play weighted scripts
+of ordinary commands, with some thinking time in between.
+
+Every command is followed by a marker, a command of its own whose
+answer repeats a token unique to it, so the bot knows where the answer
+to its command ends. The command is timed from the moment it is sent to
+the first line of that answer, leaving out what other players and
+monsters cause, like someone talking or a monster attacking. The tool
+reports throughput and latency percentiles while it runs, and per
+command at the end. The server runs the markers as well, so they count
+towards throughput, which is every command the server answered.
+
+usage: python bench/loadgen.py [--bots N] [--duration SECONDS]
+                               [--host HOST] [--port PORT]
+
+"""
+import argparse
+import asyncio
+import random
+import re
+import sys
+import time
+from collections import defaultdict
+
+# what the bots do once they're in: (weight, commands run one after the
+# other)
+SCRIPTS = {
+    "explore": (5, ["look", "go north", "look", "go south", "look"]),
+    "check": (3, ["stats", "hp", "xp", "inv"]),
+    "fight": (2, ["attack goblin", "hp"]),
+    "shop": (2, ["go north", "go north", "go west", "list", "buy torch",
+                 "inv", "go east", "go south", "go south"]),
+    "chat": (1, ["say hello"]),
+}
+
+# telnet commands and subnegotiations, which the bots don't take part in
+_TELNET = re.compile(rb"\xff\xfa.*?\xff\xf0|\xff[\xfb-\xfe].|\xff[\xf0-\xfa]",
+                     re.DOTALL)
+
+# sent after every command. The game answers "You can't eat <token>!",
+# which is cheap and changes nothing. It counts against the items rate
+# limit, so bots thinking much less than half a second between commands
+# have their markers held back
+_MARKER = "eat {}"
+
+# lines about what other players or monsters did, which don't answer
+# anything the bot sent
+_CHATTER = re.compile(
+    r" says: | just (arrived|left) | entered the game$| quit the game$"
+    r"|appeared in a blinding flash"
+    r"|^The .* attacked .* with their "
+    r"|^The .*'s poorly executed attack(ed)? misses you"
+    r"|^As the final blow strikes|^You awaken after")
+
+
+class Stats():
+    """ what all the bots saw """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # seconds each command took to be answered, by command
+        self.latencies = defaultdict(list)
+        # (finished, seconds) for every answered command, for the reports
+        self.answered = []
+        # markers answered, which the server ran on top of the commands
+        self.markers = 0
+        self.bytes_in = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.connected = 0
+        self.playing = 0
+
+
+class Bot():
+    """ one telnet connection playing the game """
+
+    def __init__(self, number, args, stats, rng):
+        self._number = number
+        self._args = args
+        self._stats = stats
+        self._rng = rng
+        self._reader = None
+        self._writer = None
+        # text received that doesn't make up a whole line yet
+        self._partial = ""
+        # (test for a line, future) the reader completes on a matching line
+        self._pending = None
+        # commands sent so far, which makes each marker unique
+        self._sequence = 0
+
+    async def run(self, until):
+        """ connect, make a character and play until 'until' """
+        stats = self._stats
+        try:
+            self._reader, self._writer = await asyncio.open_connection(
+                self._args.host, self._args.port)
+        except OSError:
+            stats.errors += 1
+            return
+        stats.connected += 1
+        reading = asyncio.ensure_future(self._read())
+
+        try:
+            await self._create()
+            stats.playing += 1
+            await self._play(until)
+        except (asyncio.TimeoutError, ConnectionError, EOFError):
+            stats.errors += 1
+        finally:
+            reading.cancel()
+            self._writer.close()
+            stats.connected -= 1
+
+    async def _create(self):
+        """ name, species and class """
+        for prompt, answer in (("What is your name?", f"bot{self._number}"),
+                               ("What species are you?", "0"),
+                               ("What class are you?", "0"),
+                               ("Welcome to the game", None)):
+            await self._wait(lambda line, now, prompt=prompt: prompt in line,
+                             self._args.timeout)
+            if answer is not None:
+                self._send(answer)
+
+    async def _play(self, until):
+        """ run scripts until it's time to stop """
+        names = list(SCRIPTS)
+        weights = [SCRIPTS[name][0] for name in names]
+        while time.perf_counter() < until:
+            script = self._rng.choices(names, weights)[0]
+            for command in SCRIPTS[script][1]:
+                await asyncio.sleep(
+                    self._rng.expovariate(1 / self._args.think))
+                if time.perf_counter() >= until:
+                    return
+                await self._command(command)
+
+    async def _command(self, command):
+        """ send a command and time how long it takes to be answered """
+        stats = self._stats
+        self._sequence += 1
+        token = f"mark{self._number}x{self._sequence}"
+
+        # the answer is whatever isn't chatter between the command and the
+        # marker. A command that gets no answer is timed to the marker
+        answered = []
+
+        def is_marker(line, now):
+            if token in line:
+                return True
+            if not answered and not _CHATTER.search(line):
+                answered.append(now)
+            return False
+
+        sent = time.perf_counter()
+        self._send(command)
+        self._send(_MARKER.format(token))
+        try:
+            marked = await self._wait(is_marker, self._args.timeout)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            return
+
+        latency = (answered[0] if answered else marked) - sent
+        stats.latencies[command.split()[0]].append(latency)
+        stats.answered.append((marked, latency))
+        stats.markers += 1
+
+    def _send(self, line):
+        """ type a line """
+        self._writer.write(line.encode("latin1") + b"\r\n")
+
+    async def _wait(self, test, timeout):
+        """
+        wait for a line that passes 'test(line, when it came)', returning
+        when it came
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending = (test, future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending = None
+
+    async def _read(self):
+        """ read whatever the server sends, and hand lines to '_wait' """
+        while True:
+            data = await self._reader.read(65536)
+            if not data:
+                if self._pending is not None:
+                    future = self._pending[1]
+                    if not future.done():
+                        future.set_exception(EOFError())
+                return
+            now = time.perf_counter()
+            self._stats.bytes_in += len(data)
+
+            text = self._partial + _TELNET.sub(b"", data).decode("latin1")
+            lines = text.split("\n")
+            self._partial = lines.pop()
+            for line in lines:
+                line = line.strip("\r")
+                if not line or self._pending is None:
+                    continue
+                test, future = self._pending
+                if not future.done() and test(line, now):
+                    future.set_result(now)
+
+
+def _percentile(values, fraction):
+    """ the value 'fraction' of the way up the sorted values """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _ms(values, fraction):
+    """ a percentile in milliseconds, for printing """
+    return f"{_percentile(values, fraction) * 1000:8.1f}" if values else \
+        f"{'-':>8}"
+
+
+async def _report(stats, interval):
+    """ print how things are going every 'interval' seconds """
+    done = 0
+    last_markers = 0
+    last_bytes = 0
+    print(f"{'time':>6} {'conn':>6} {'playing':>7} {'cmd/s':>8} "
+          f"{'KB/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'timeouts':>8}")
+    while True:
+        await asyncio.sleep(interval)
+        latest = [x[1] for x in stats.answered[done:]]
+        done = len(stats.answered)
+        markers = stats.markers - last_markers
+        last_markers = stats.markers
+        received = stats.bytes_in - last_bytes
+        last_bytes = stats.bytes_in
+        print(f"{time.perf_counter() - stats.started:6.0f} "
+              f"{stats.connected:6} {stats.playing:7} "
+              f"{(len(latest) + markers) / interval:8.1f} "
+              f"{received / interval / 1024:8.1f} "
+              f"{_ms(latest, 0.5)} {_ms(latest, 0.99)} {stats.timeouts:8}")
+
+
+async def _main(args):
+    """ start the bots a few at a time, and let them play """
+    stats = Stats()
+    rng = random.Random(args.seed)
+    until = time.perf_counter() + args.duration
+    reporting = asyncio.ensure_future(_report(stats, args.report))
+
+    bots = []
+    for number in range(args.bots):
+        bot = Bot(number, args, stats, random.Random(rng.random()))
+        bots.append(asyncio.ensure_future(bot.run(until)))
+        await asyncio.sleep(1 / args.ramp)
+    await asyncio.gather(*bots)
+    reporting.cancel()
+
+    elapsed = time.perf_counter() - stats.started
+    scripted = sum(len(x) for x in stats.latencies.values())
+    total = scripted + stats.markers
+    print()
+    print(f"{args.bots} bots, {stats.playing} made it into the game, "
+          f"{stats.errors} errors, {stats.timeouts} timeouts")
+    print(f"{total} commands ({scripted} scripted, {stats.markers} markers) "
+          f"in {elapsed:.0f}s, {total / elapsed:.1f}/s, "
+          f"{stats.bytes_in / elapsed / 1024:.1f} KB/s received")
+    print(f"{'command':>10} {'count':>7} {'p50 ms':>8} {'p90 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8}")
+    for command, values in sorted(stats.latencies.items()):
+        print(f"{command:>10} {len(values):7} {_ms(values, 0.5)} "
+              f"{_ms(values, 0.9)} {_ms(values, 0.99)} "
+              f"{max(values) * 1000:8.1f}")
+    every = [x for values in stats.latencies.values() for x in values]
+    if every:
+        print(f"{'all':>10} {len(every):7} {_ms(every, 0.5)} "
+              f"{_ms(every, 0.9)} {_ms(every, 0.99)} "
+              f"{max(every) * 1000:8.1f}")
+
+
+def main():
+    """ parse the command line and run the bots """
+    parser = argparse.ArgumentParser(
+        description="telnet load generator for tgamud")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--bots", type=int, default=100,
+                        help="connections to open")
+    parser.add_argument("--duration", type=float, default=60,
+                        help="seconds to play for")
+    parser.add_argument("--ramp", type=float, default=50,
+                        help="new connections per second")
+    parser.add_argument("--think", type=float, default=1.0,
+                        help="average seconds between a bot's commands")
+    parser.add_argument("--timeout", type=float, default=10,
+                        help="seconds to wait for an answer")
+    parser.add_argument("--report", type=float, default=5,
+                        help="seconds between progress reports")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    asyncio.run(_main(args))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
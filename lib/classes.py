@@ -1,9 +1,7 @@
 """ Classes class """
-import random
-
 import yaml
 
-from lib.dice import Dice
+from lib.sim import Sim
 
 
 class Classes():
@@ -11,7 +9,7 @@ class Classes():
     This class contains all of the functions to allow the game to operate
     """
 
-    def __init__(self):
+    def __init__(self, sim=None):
         """ read in the config files """
         with open("conf/classes.yaml", "rb") as stream:
             try:
@@ -19,7 +17,9 @@ class Classes():
             except yaml.YAMLError as exc:
                 print(exc)
 
-        self._dice = Dice()
+        sim = sim or Sim()
+        self._rng = sim.stream("character")
+        self._dice = sim.dice("character")
 
         self._extra_attacks = {
             (0,  1,  2,  3,  4): 0,
@@ -142,7 +142,7 @@ class Classes():
             return
 
         for _ in range(2):
-            ability = random.choice(self.abilities)
+            ability = self._rng.choice(self.abilities)
             max_stats = []
             while True:
                 if player[ability] < 20:
@@ -150,7 +150,7 @@ class Classes():
                 max_stats.append(ability)
                 if len(max_stats) == len(self.abilities):
                     break
-                ability = random.choice(self.abilities)
+                ability = self._rng.choice(self.abilities)
             if len(max_stats) < len(self.abilities):
                 player[ability] += 1
 
@@ -0,0 +1,161 @@
+""" command class """
+
+
+class Command():
+    """
+    A command players can type, and what the game needs to know about it
+    """
+
+    def __init__(self, name, handler, aliases=(), usage="", summary="",
+                 rate_class=None, needs_player=True, fatigue=False,
+                 abbreviate=True, min_abbreviation=None):
+        """ describe the command """
+        self.name = name
+        # called with the player's id, the command's name and what they
+        # typed after it
+        self.handler = handler
+        self.aliases = tuple(aliases)
+        # what help shows for it. Commands without a summary aren't shown
+        self.usage = usage or name
+        self.summary = summary
+        # which of the server's rate limits the command counts against
+        self.rate_class = rate_class
+        # whether only players that finished making their character can use
+        # it
+        self.needs_player = needs_player
+        # whether using it tires the player out. The handler does the
+        # tiring, this tells players about it
+        self.fatigue = fatigue
+        # whether it answers to abbreviations of its name. Commands that
+        # can't be undone, like quitting, have to be typed out
+        self.abbreviate = abbreviate
+        # the shortest abbreviation it answers to, for commands whose
+        # shorter ones are everyday words, like "heal" for health. None
+        # leaves it to the registry
+        self.min_abbreviation = min_abbreviation
+        # times it was used
+        self.calls = 0
+
+
+class Commands():
+    """
+    Maps what players type to commands. Besides its name and aliases, a
+    command answers to any abbreviation of its name that no other command
+    shares, e.g. "nor" for "north" but not "sel", which could be "sell" or
+    "select". Abbreviations are at least 'min_abbreviation' letters long,
+    since anything players type that isn't a command is said out loud, and
+    "no thanks" shouldn't walk them north. A command can ask for longer
+    ones still. Finding a command takes one step per letter typed
+    """
+
+    def __init__(self, min_abbreviation=3):
+        """ start with no commands """
+        self._min_abbreviation = min_abbreviation
+
+        # the commands, in the order they were added
+        self._commands = []
+
+        # maps names and aliases to their command
+        self._exact = {}
+
+        # trie of the command names. Each node maps a letter to the next
+        # node, and the commands whose names go through a node are kept
+        # under None
+        self._trie = {None: set()}
+
+    def __iter__(self):
+        return iter(self._commands)
+
+    def add(self, name, handler, **kwargs):
+        """ add a command, see Command for the arguments """
+        command = Command(name, handler, **kwargs)
+        for word in (name,) + command.aliases:
+            if word in self._exact:
+                raise ValueError(f"{word} is already a command")
+
+        self._commands.append(command)
+        for word in (name,) + command.aliases:
+            self._exact[word] = command
+
+        node = self._trie
+        for letter in name:
+            node = node.setdefault(letter, {None: set()})
+            node[None].add(command)
+
+        return command
+
+    def find(self, word, abbreviations=True):
+        """
+        the command word stands for, or None if there isn't exactly one.
+        Without abbreviations only names and aliases count
+        """
+        command = self._exact.get(word)
+        if command is not None or not abbreviations \
+                or len(word) < self._min_abbreviation:
+            return command
+
+        node = self._trie
+        for letter in word:
+            node = node.get(letter)
+            if node is None:
+                return None
+
+        if len(node[None]) != 1:
+            return None
+        command = next(iter(node[None]))
+        return command if self._abbreviates(command, word) else None
+
+    def _abbreviates(self, command, word):
+        """ whether command answers to word, a prefix only it has """
+        if not command.abbreviate:
+            return False
+        shortest = command.min_abbreviation
+        if shortest is None:
+            shortest = self._min_abbreviation
+        return len(word) >= shortest
+
+    def run(self, uid, word, params):
+        """
+        run the command word stands for. returns False if there is no such
+        command
+        """
+        command = self.find(word)
+        if command is None:
+            return False
+
+        command.calls += 1
+        command.handler(uid, command.name, params)
+        return True
+
+    def rate_classes(self):
+        """
+        maps every word that finds a command with a rate class, names,
+        aliases and abbreviations alike, to that class
+        """
+        classes = {}
+        for word, command in self._exact.items():
+            if command.rate_class is not None:
+                classes[word] = command.rate_class
+
+        # walk the trie for the abbreviations, which are the nodes only one
+        # command goes through
+        stack = [("", self._trie)]
+        while stack:
+            prefix, node = stack.pop()
+            for letter, child in node.items():
+                if letter is None:
+                    continue
+                word = prefix + letter
+                stack.append((word, child))
+                if len(child[None]) != 1 or word in self._exact:
+                    continue
+                command = next(iter(child[None]))
+                if self._abbreviates(command, word) \
+                        and command.rate_class is not None:
+                    classes[word] = command.rate_class
+
+        return classes
+
+    def get_stats(self):
+        """ maps each command's name to the number of times it was used """
+        return {command.name: command.calls for command in self._commands}
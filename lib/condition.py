@@ -1,9 +1,8 @@
 """ condition class """
-import time
 import yaml
 
-from lib.dice import Dice
 from lib.gear import Gear
+from lib.sim import Sim
 
 
 class Condition():
@@ -11,11 +10,13 @@ class Condition():
     This class contains all of the functions to allow the game to operate
     """
 
-    def __init__(self):
+    def __init__(self, sim=None):
         """ read in the config files """
         self.conditions = []
 
-        self._dice = Dice()
+        sim = sim or Sim()
+        self._now = sim.time
+        self._dice = sim.dice("status")
 
         self._gear = Gear()
 
@@ -63,7 +64,7 @@ class Condition():
     def set_condition(self, name):
         """ add a condition to the list """
         condition = self.get_condition_handle(name).copy()
-        condition["start"] = time.time()
+        condition["start"] = self._now()
 
         return condition
 
@@ -103,30 +104,47 @@ class Condition():
 
         for condition in player["conditions"]:
             if condition["repeating"]:
-                if time.time() - condition["start"] > condition["duration"]:
+                if self._now() - condition["start"] >= condition["duration"]:
                     condition["condition"] = condition["type"]
                     conditions.append(condition)
                     if 'damage' in condition.keys():
-                        if time.time() - condition["update"] > 6:
+                        if self._now() - condition["update"] >= 6:
                             print("damaging repeating condition")
                             player["current_hp"] -= self._dice.roll(
                                 condition["damage"])
-                            condition["update"] = time.time()
+                            condition["update"] = self._now()
                 else:
                     conditions.append(condition)
             else:
-                if time.time() - condition["start"] < condition["duration"]:
+                if self._now() - condition["start"] < condition["duration"]:
                     if 'damage' in condition.keys():
-                        if time.time() - condition["update"] > 6:
+                        if self._now() - condition["update"] >= 6:
                             print("damaging condition")
                             player["current_hp"] -= self._dice.roll(
                                 condition["damage"])
-                            condition["update"] = time.time()
+                            condition["update"] = self._now()
                     conditions.append(condition)
 
         player["conditions"] = conditions
         player["status"] = self.get_status(player)
 
+    def next_change(self, condition):
+        """ when check_condition next has something to do for a condition """
+        expires = condition["start"] + condition["duration"]
+        hurts = 'damage' in condition.keys()
+
+        # repeating conditions set in once their time is up and then keep
+        # hurting every 6s
+        if condition["repeating"]:
+            if self._now() < expires:
+                return expires
+            return condition["update"] + 6 if hurts else None
+
+        # the rest hurt every 6s until they wear off
+        if self._now() >= expires:
+            return None
+        return min(expires, condition["update"] + 6) if hurts else expires
+
     def eat(self, player, meal):
         """ eat a thing and see what happens """
         foods = [x for x in self._gear.gears if x['dtype'] == 'food']
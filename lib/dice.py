@@ -7,15 +7,15 @@ class Dice():
     This class contains all of the functions to allow the game to operate
     """
 
-    def __init__(self):
-        """ read in the config files """
+    def __init__(self, rng=random):
+        """ roll with rng, anything with randint(), e.g. a random.Random """
+        self._rng = rng
 
-    @staticmethod
-    def roll(dice):
+    def roll(self, dice):
         """ roll the dice"""
         score = 0
         for _ in range(dice[0]):
-            score += random.randint(1, dice[1])
+            score += self._rng.randint(1, dice[1])
 
         if len(dice) > 2:
             return score + dice[2]
@@ -0,0 +1,189 @@
+""" events class """
+
+
+class Event():
+    """
+    Something that happened in the game that players may want to hear
+    about. Events only hold the facts, turning them into text is up to the
+    renderers
+    """
+
+    __slots__ = ()
+
+
+class PlayerEntered(Event):
+    """ a player finished making their character """
+
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class PlayerQuit(Event):
+    """ a player left the game """
+
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class PlayerMoved(Event):
+    """ a player went from one room to the next through 'direction' """
+
+    __slots__ = ("name", "direction")
+
+    def __init__(self, name, direction):
+        self.name = name
+        self.direction = direction
+
+
+class PlayerSaid(Event):
+    """ a player said 'message' out loud """
+
+    __slots__ = ("name", "message")
+
+    def __init__(self, name, message):
+        self.name = name
+        self.message = message
+
+
+class MonsterAppeared(Event):
+    """ a monster was spawned """
+
+    __slots__ = ("monster",)
+
+    def __init__(self, monster):
+        self.monster = monster
+
+
+class DamageDealt(Event):
+    """ 'attacker' hit 'target' with 'weapon' for 'damage' """
+
+    __slots__ = ("attacker", "target", "weapon", "damage")
+
+    def __init__(self, attacker, target, weapon, damage):
+        self.attacker = attacker
+        self.target = target
+        self.weapon = weapon
+        self.damage = damage
+
+
+class TextRenderer():
+    """
+    Turns events into the lines a telnet player reads. What a player is
+    told depends on the role they had in the event, e.g. whether they are
+    in the room someone left or the one they arrived in
+    """
+
+    def __init__(self):
+        """ know how to render every kind of event """
+        self._renderers = {
+            PlayerEntered: self._player_entered,
+            PlayerQuit: self._player_quit,
+            PlayerMoved: self._player_moved,
+            PlayerSaid: self._player_said,
+            MonsterAppeared: self._monster_appeared,
+            DamageDealt: self._damage_dealt,
+        }
+
+    def render(self, event, role):
+        """ the lines to send for event to players that had role in it """
+        return self._renderers[type(event)](event, role)
+
+    @staticmethod
+    def _player_entered(event, role):
+        return [f"{event.name} entered the game"]
+
+    @staticmethod
+    def _player_quit(event, role):
+        return [f"{event.name} quit the game"]
+
+    @staticmethod
+    def _player_moved(event, role):
+        if role == "origin":
+            return [f"{event.name} just left to the {event.direction}."]
+        return [f"{event.name} just arrived from the {event.direction}."]
+
+    @staticmethod
+    def _player_said(event, role):
+        return [f"{event.name} says: {event.message}"]
+
+    @staticmethod
+    def _monster_appeared(event, role):
+        return [f"A {event.monster} just appeared in a blinding flash of "
+                f"light."]
+
+    @staticmethod
+    def _damage_dealt(event, role):
+        return [f"The {event.attacker} attacked {event.target} with their "
+                f"{event.weapon}!"]
+
+
+class EventBus():
+    """
+    Carries events from the game to the players' renderers. The game emits
+    events as things happen, along with who saw them in what role, and
+    they wait on the bus until it is flushed. A flush renders each event
+    once per renderer, for everyone sharing it, and hands the text to the
+    server in the order the events happened.
+
+    Only players with a renderer subscribed hear about events. With no
+    renderers at all, e.g. for a headless run that doesn't look at the
+    output, events are dropped as soon as they are emitted
+    """
+
+    def __init__(self, mud):
+        """ start with nobody listening """
+        self._mud = mud
+
+        # maps a player's id to the renderer turning events into text for
+        # them
+        self._renderers = {}
+
+        # (event, {role: player ids}) for each event not flushed yet
+        self._pending = []
+
+        # events emitted, and those rendered for someone
+        self.emitted = 0
+        self.rendered = 0
+
+    def subscribe(self, session, renderer):
+        """ have renderer turn events into text for player session """
+        self._renderers[session] = renderer
+
+    def unsubscribe(self, session):
+        """ stop telling player session about events """
+        self._renderers.pop(session, None)
+
+    def emit(self, event, **audiences):
+        """
+        event happened, seen by the player ids in each audience, e.g.
+        emit(PlayerMoved(...), origin=[...], destination=[...]). It is
+        rendered on the next flush
+        """
+        self.emitted += 1
+        if self._renderers:
+            self._pending.append((event, audiences))
+
+    def flush(self):
+        """ render the events emitted since the last flush and send them """
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, []
+        for event, audiences in pending:
+            for role, sessions in audiences.items():
+                # everyone with the same renderer gets the same text, so it
+                # is only rendered once for all of them
+                groups = {}
+                for session in sessions:
+                    renderer = self._renderers.get(session)
+                    if renderer is not None:
+                        groups.setdefault(renderer, []).append(session)
+
+                for renderer, group in groups.items():
+                    self.rendered += 1
+                    for line in renderer.render(event, role):
+                        self._mud.multicast(group, line)
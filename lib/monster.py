@@ -1,6 +1,4 @@
 """ monsters class """
-import time
-
 import yaml
 
 
@@ -36,9 +34,6 @@ class Monster():
             155000
         )
 
-        self.populate = time.time()
-        self.spawn_timer = time.time()
-
     def natural_weapon(self, weapon):
         """ get natty weapon """
         return self.natural_weapons[weapon].copy()
@@ -0,0 +1,95 @@
+""" scheduler class """
+import heapq
+import itertools
+import time
+
+
+class Scheduler():
+    """
+    Runs callbacks at the time they were scheduled for. The timers sit in
+    a heap ordered by deadline, so finding the due ones only ever looks at
+    the timers that are due, not at everything that has a timer
+    """
+
+    def __init__(self, clock=time.time):
+        """ start with no timers, telling the time by clock() """
+        self._clock = clock
+
+        # [deadline, sequence, key, callback] for each timer, soonest first.
+        # Cancelled timers stay in the heap with no callback until they
+        # reach the top
+        self._heap = []
+
+        # breaks ties between timers with the same deadline, first come
+        # first served
+        self._sequence = itertools.count()
+
+        # maps a key to the heap entry of its timer
+        self._timers = {}
+
+    def __contains__(self, key):
+        """ whether a timer is set for key """
+        return key in self._timers
+
+    def __len__(self):
+        """ number of timers set """
+        return len(self._timers)
+
+    def call_at(self, deadline, key, callback):
+        """
+        call callback() at deadline (a clock() value). There is only
+        ever one timer per key, so this replaces any timer already set for
+        key
+        """
+        self.cancel(key)
+        entry = [deadline, next(self._sequence), key, callback]
+        self._timers[key] = entry
+        heapq.heappush(self._heap, entry)
+
+    def cancel(self, key):
+        """ forget the timer for key, if there is one """
+        entry = self._timers.pop(key, None)
+        if entry is not None:
+            entry[3] = None
+
+    def deadline(self, key):
+        """ when the timer for key goes off, or None if it isn't set """
+        entry = self._timers.get(key)
+        return None if entry is None else entry[0]
+
+    def next_deadline(self):
+        """ when the next timer goes off, or None if there aren't any """
+        heap = self._heap
+        while heap and heap[0][3] is None:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def run_due(self, now=None):
+        """
+        call everything that is due, soonest first. Timers set by the
+        callbacks wait for the next call even if they are already due, so
+        a callback that keeps setting itself can't hold everyone up.
+        returns the number of callbacks called
+        """
+        if now is None:
+            now = self._clock()
+
+        heap = self._heap
+        limit = next(self._sequence)
+        later = []
+        count = 0
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            if entry[3] is None:
+                continue
+            if entry[1] > limit:
+                later.append(entry)
+                continue
+            del self._timers[entry[2]]
+            entry[3]()
+            count += 1
+
+        for entry in later:
+            heapq.heappush(heap, entry)
+
+        return count
@@ -0,0 +1,87 @@
+""" sim class """
+import random
+import time
+
+from lib.dice import Dice
+
+
+class Sim():
+    """
+    The clock and the random numbers the game runs on. Each part of the game
+    draws from a stream of its own, e.g. "combat" or "loot", so an extra
+    loot roll doesn't change how the next fight goes. Given a seed, every
+    stream comes out the same on every run
+    """
+
+    def __init__(self, seed=None, clock=time.time):
+        """ seed None draws from the system's randomness """
+        self.seed = seed
+        self.time = clock
+        self._streams = {}
+        self._dice = {}
+
+    def stream(self, name):
+        """ the random.Random for a part of the game """
+        rng = self._streams.get(name)
+        if rng is None:
+            if self.seed is None:
+                rng = random.Random()
+            else:
+                # a string seed is hashed into the state, so this comes out
+                # the same in every process
+                rng = random.Random(f"{self.seed}:{name}")
+            self._streams[name] = rng
+        return rng
+
+    def dice(self, name):
+        """ dice rolling from the stream for a part of the game """
+        dice = self._dice.get(name)
+        if dice is None:
+            dice = self._dice[name] = Dice(self.stream(name))
+        return dice
+
+
+class VirtualClock():
+    """
+    A clock that only moves when told to. Sleeping on it moves it on right
+    away, so a game run on it goes as fast as the CPU allows
+    """
+
+    def __init__(self, start=0.0):
+        """ start the clock at 'start' """
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        """ move the clock on by 'seconds' """
+        if seconds > 0:
+            self.now += seconds
+
+
+class TickClock():
+    """
+    A clock that stands still while a tick runs. It reads 'source' once,
+    when the tick starts, and tells that time until the next one, so
+    everything in a tick happens at the same moment however long the tick
+    takes. Given the times the ticks started, the game plays out the same
+    way again
+    """
+
+    def __init__(self, source=time.time):
+        """ start the clock at the time 'source' tells now """
+        self._source = source
+        self.now = source()
+
+    def __call__(self):
+        return self.now
+
+    def tick(self):
+        """ start a new tick at the time 'source' tells now """
+        self.now = self._source()
+        return self.now
+
+    def remaining(self, timeout):
+        """ how much is left of 'timeout' seconds from when the tick began """
+        return max(0, self.now + timeout - self._source())
@@ -1,10 +1,9 @@
 """ weapon class """
-import time
 import yaml
 
 from lib.condition import Condition
 from lib.classes import Classes
-from lib.dice import Dice
+from lib.sim import Sim
 
 
 class Trap:
@@ -12,7 +11,7 @@ class Trap:
     This class contains all the functions to allow the game to operate
     """
 
-    def __init__(self):
+    def __init__(self, sim=None):
         """ read in the config files """
         with open("conf/traps.yaml", "rb") as stream:
             try:
@@ -20,22 +19,24 @@ class Trap:
             except yaml.YAMLError as exc:
                 print(exc)
 
-        self._condition = Condition()
-        self._classes = Classes()
-        self._dice = Dice()
+        sim = sim or Sim()
+        self._now = sim.time
+        self._condition = Condition(sim)
+        self._classes = Classes(sim)
+        self._dice = sim.dice("traps")
 
     def detect_trap(self, player, num):
         """ try to detect trap """
         trap = self.traps[num]
 
-        if time.time() - trap["detected"] < 60:
+        if self._now() - trap["detected"] < 60:
             return True, trap["detect"]
 
         if self._classes.get_modifier(player["wisdom"]) \
                 + self._dice.roll([1, 20]) \
                 > trap["dc"]:
 
-            trap["detected"] = time.time()
+            trap["detected"] = self._now()
             return True, trap["detect"]
 
         return False, trap["not_detect"]
@@ -50,7 +51,7 @@ class Trap:
                 > trap["dc"]:
 
             message = trap["avoid"]
-            trap["detected"] = time.time()
+            trap["detected"] = self._now()
 
         else:
             damage = self._dice.roll(trap["damage"])
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+ File Name : async_mud.py
+
+asyncio flavour of the MUD server. It hands out the same new player,
+disconnected player and command events as Mud, so the game code does
+not care which one it is talking to, but every read and write happens
+inside the asyncio event loop instead of by polling sockets.
+
+"""
+import asyncio
+
+from server.mud import Mud
+
+
+class AsyncMud(Mud):
+    """A MUD server built on asyncio protocols.
+
+    Call 'start' from inside a running event loop to begin listening,
+    then await 'wait' in the game loop. It returns as soon as a player
+    connects, leaves or sends a command, or when the timeout runs out,
+    after which 'update' and the 'get_*' methods behave exactly like
+    they do on Mud.
+    """
+
+    class _Protocol(asyncio.Protocol):
+        """Feeds the events of one telnet connection into the server"""
+
+        def __init__(self, mud):
+            self._mud = mud
+            self._clid = None
+
+        def connection_made(self, transport):
+            sock = transport.get_extra_info("socket")
+            if sock is not None:
+                self._mud._set_keepalive(sock)
+            address = transport.get_extra_info("peername") or ("", 0)
+            self._clid = self._mud._add_client(transport, address[0])
+            self._mud._notify()
+
+        def data_received(self, data):
+            clnt = self._mud._clients.get(self._clid)
+            if clnt is None:
+                return
+            self._mud._receive(self._clid, clnt, data)
+            self._mud._notify()
+
+        def connection_lost(self, exc):
+            self._mud._handle_disconnect(self._clid)
+            self._mud._notify()
+
+    # address to listen on once 'start' is called
+    _address = None
+    # the asyncio server accepting new connections
+    _server = None
+    # set whenever a new event arrives so that 'wait' can return
+    _wakeup = None
+
+    def _listen(self, host, port):
+        """Remembers where to listen. The socket is opened by 'start'"""
+        self._address = (host, port)
+
+    async def start(self):
+        """Starts accepting telnet connections on the running loop"""
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._server = await loop.create_server(
+            lambda: AsyncMud._Protocol(self), *self._address,
+            reuse_address=True, reuse_port=self._reuse_port or None,
+            backlog=self._listen_backlog)
+        self._listen_socket = self._server.sockets[0]
+
+    async def wait(self, timeout=None):
+        """Sleeps until a player does something or 'timeout' seconds
+        have passed, whichever comes first.
+        """
+        # don't sleep past the moment a rate limited client may go on or an
+        # idle one times out
+        timeout = self._wait_timeout(timeout)
+        if timeout != 0:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._wakeup.clear()
+
+    def _notify(self):
+        """Wakes up anyone waiting in 'wait'"""
+        self._wakeup.set()
+
+    def _poll(self, timeout):
+        # the event loop has already done all the reading (and waiting) for us
+        pass
+
+    def _flush_client(self, clid, clnt):
+        data = self._take_output(clnt)
+
+        # the transport buffers whatever the socket can't take right now and
+        # writes it out when the client is ready for it
+        clnt.sock.write(data)
+
+    def _backlog(self, clnt):
+        return clnt.sock.get_write_buffer_size() + clnt.outbox_size
+
+    def _close_client(self, clnt):
+        # closing the transport still sends anything that was buffered
+        clnt.sock.close()
+
+    def shutdown(self):
+        """Closes down the server, disconnecting all clients and
+        closing the listen socket.
+        """
+        self.flush()
+
+        for clnt in self._clients.values():
+            clnt.sock.close()
+        self._server.close()
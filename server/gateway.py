@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+"""
+ File Name : gateway.py
+
+Gateway flavour of the MUD server. The client sockets, telnet parsing
+and output writes are handed to one or more gateway processes, so that
+the protocol work runs on as many cores as there are gateways while the
+game itself stays in a single process.
+
+Each gateway is a Mud of its own accepting from the shared listen
+socket. It forwards the lines its players type to the game process over
+a local socket, and the game sends back everything said to those
+players at the end of each tick, batched into one write per gateway.
+
+Both directions use the same framing: a header holding the frame kind,
+the gateway's id for the client and the payload length, followed by
+the payload.
+
+"""
+import multiprocessing
+import selectors
+import signal
+import socket
+import struct
+
+from server.mud import Mud
+
+# gateway -> game: a client connected, the payload is its address
+FRAME_NEW = 1
+# gateway -> game: a client went away
+FRAME_LEFT = 2
+# gateway -> game: a line the client typed, telnet codes already removed
+FRAME_LINE = 3
+# game -> gateway: output for a client
+FRAME_OUTPUT = 4
+# game -> gateway: hang up on a client
+FRAME_DISCONNECT = 5
+
+_HEADER = struct.Struct("!BII")
+
+
+class _Channel():
+    """One end of the local socket between the game and a gateway"""
+
+    # how much we read from the socket at a time
+    _READ_SIZE = 65536
+
+    def __init__(self, sock):
+        sock.setblocking(False)
+        self.sock = sock
+        # bytes read that don't make up a whole frame yet
+        self.inbuf = bytearray()
+        # framed bytes the socket has not accepted yet
+        self.pending = bytearray()
+        # what the owner has the socket watched with
+        self.callback = None
+
+    def send(self, kind, cid, payload=b""):
+        """Frames a message for the next 'write'"""
+        self.pending += _HEADER.pack(kind, cid, len(payload))
+        self.pending += payload
+
+    def write(self):
+        """Writes as much pending data as the socket takes. Returns
+        True once it has all gone.
+        """
+        if self.pending:
+            try:
+                sent = self.sock.send(self.pending)
+            except BlockingIOError:
+                sent = 0
+            del self.pending[:sent]
+        return not self.pending
+
+    def read(self):
+        """Returns the (kind, cid, payload) frames that have arrived.
+        Raises EOFError once the other end has closed the socket.
+        """
+        try:
+            data = self.sock.recv(self._READ_SIZE)
+        except BlockingIOError:
+            return []
+        if not data:
+            raise EOFError
+        self.inbuf += data
+
+        frames = []
+        offset = 0
+        while len(self.inbuf) - offset >= _HEADER.size:
+            kind, cid, size = _HEADER.unpack_from(self.inbuf, offset)
+            end = offset + _HEADER.size + size
+            if end > len(self.inbuf):
+                break
+            frames.append((kind, cid, bytes(self.inbuf[end - size:end])))
+            offset = end
+        del self.inbuf[:offset]
+        return frames
+
+
+class _Gateway(Mud):
+    """The Mud running inside a gateway process"""
+
+    # the listen socket shared by all the gateways
+    _shared_socket = None
+    # connection to the game process
+    _channel = None
+
+    def __init__(self, listen_socket, sock, **kwargs):
+        self._shared_socket = listen_socket
+        self._channel = _Channel(sock)
+        super().__init__(**kwargs)
+
+    def _listen(self, host, port):
+        # the game process already opened the listen socket for us
+        self._listen_on(self._shared_socket)
+        self._channel.callback = self._on_channel
+        self.watch(self._channel.sock, self._on_channel)
+
+    def _add_client(self, sock, address):
+        clid = super()._add_client(sock, address)
+        self._channel.send(FRAME_NEW, clid, address.encode("latin1"))
+        return clid
+
+    def _handle_disconnect(self, clid):
+        if clid in self._clients:
+            self._channel.send(FRAME_LEFT, clid)
+        super()._handle_disconnect(clid)
+
+    def _check_for_commands(self):
+        # commands are run by the game process, which also decides how many
+        # of them each client gets per tick, so pass every line straight on
+        for pid in self._waiting:
+            clnt = self._clients.get(pid)
+            if clnt is None:
+                continue
+            for line in clnt.lines:
+                self._channel.send(FRAME_LINE, pid, line.encode("latin1"))
+            clnt.lines.clear()
+        self._waiting.clear()
+
+    def _on_channel(self, mask):
+        """Handles what the game process sent us"""
+        if mask & selectors.EVENT_WRITE:
+            self._write_channel()
+        if not mask & selectors.EVENT_READ:
+            return
+
+        try:
+            frames = self._channel.read()
+        except (EOFError, OSError):
+            # the game is gone, so there is nobody left to play with
+            raise SystemExit(0)
+
+        for kind, cid, payload in frames:
+            if kind == FRAME_OUTPUT:
+                self._queue_output(cid, payload)
+            elif kind == FRAME_DISCONNECT:
+                self.get_disconnect(cid)
+
+    def _write_channel(self):
+        """Sends the game what we have for it"""
+        done = self._channel.write()
+        self.watch(self._channel.sock, self._on_channel, write=not done)
+
+    def run(self):
+        """Serves clients until the game process goes away"""
+        try:
+            while True:
+                self.update(None)
+                self._write_channel()
+        except SystemExit:
+            pass
+        finally:
+            self.shutdown()
+
+
+def _serve(listen_socket, sock, options):
+    """Entry point of a gateway process"""
+
+    # ctrl-c is for the game process. We stop when it closes our channel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _Gateway(listen_socket, sock, **options).run()
+
+
+class GatewayMud(Mud):
+    """A MUD server whose clients are looked after by gateway processes.
+
+    It hands out the same new player, disconnected player and command
+    events as Mud and takes the same options, which the gateways apply
+    to the connections they own. 'gateways' is how many gateway
+    processes to start.
+
+    The gateways normally take turns accepting from one listen socket.
+    With 'reuse_port' each gets a socket of its own on the same port,
+    and the kernel decides which gateway a new connection goes to, so
+    a flood of connections is accepted by all of them at once instead
+    of whichever gateway woke up first.
+    """
+
+    # settings passed on to each gateway
+    _options = None
+    # how many gateway processes to start
+    _gateway_count = 0
+    # channel to each running gateway
+    _channels = None
+    # the gateway processes
+    _processes = None
+    # maps (channel, gateway client id) to our client id
+    _sessions = None
+    # maps our client id to (channel, gateway client id)
+    _remote = None
+    # the socket each gateway accepts clients from
+    _listen_sockets = None
+
+    def __init__(self, host="0.0.0.0", port=1234, gateways=2, **kwargs):
+        self._options = dict(kwargs)
+        self._gateway_count = gateways
+        self._channels = []
+        self._processes = []
+        self._sessions = {}
+        self._remote = {}
+        self._listen_sockets = []
+        super().__init__(host, port, **kwargs)
+
+        # gateways hang up on idle clients, they can see them, and speak
+        # telnet to them, compression included
+        self._idle_timeout = None
+        self._compress = False
+
+    def _listen(self, host, port):
+        # we only watch the gateways, they accept the clients
+        self._selector = selectors.DefaultSelector()
+
+        # the sockets are all opened here, before any gateway starts, so that
+        # nobody connecting early is turned away
+        for _ in range(self._gateway_count if self._reuse_port else 1):
+            listener = self._open_listener(host, port)
+            port = listener.getsockname()[1]
+            self._listen_sockets.append(listener)
+        self._listen_socket = self._listen_sockets[0]
+
+        # spawned rather than forked, so that a gateway only holds the sockets
+        # we hand it. One that inherited another gateway's channel would keep
+        # it open after we exit, and neither would ever stop
+        context = multiprocessing.get_context("spawn")
+
+        for number in range(self._gateway_count):
+            listener = self._listen_sockets[number % len(self._listen_sockets)]
+            ours, theirs = socket.socketpair()
+            process = context.Process(
+                target=_serve, args=(listener, theirs, self._options),
+                daemon=True)
+            process.start()
+            theirs.close()
+
+            channel = _Channel(ours)
+            channel.callback = (
+                lambda mask, ch=channel: self._on_gateway(ch, mask))
+            self._channels.append(channel)
+            self._processes.append(process)
+            self.watch(ours, channel.callback)
+
+    def _on_gateway(self, channel, mask):
+        """Handles what a gateway sent us"""
+        if mask & selectors.EVENT_WRITE:
+            self._write_gateway(channel)
+        if not mask & selectors.EVENT_READ:
+            return
+
+        try:
+            frames = channel.read()
+        except (EOFError, OSError):
+            print("gateway went away")
+            self._drop_gateway(channel)
+            return
+
+        for kind, cid, payload in frames:
+            if kind == FRAME_NEW:
+                clid = self._add_client(channel, payload.decode("latin1"))
+                self._sessions[(channel, cid)] = clid
+                self._remote[clid] = (channel, cid)
+                continue
+
+            clid = self._sessions.get((channel, cid))
+            if clid is None:
+                continue
+
+            if kind == FRAME_LEFT:
+                del self._sessions[(channel, cid)]
+                del self._remote[clid]
+                self._handle_disconnect(clid)
+
+            elif kind == FRAME_LINE:
+                # the line waits its turn exactly like one we read ourselves
+                clnt = self._clients[clid]
+                clnt.lastcheck = self._clock()
+                self._queue_lines(clid, clnt, [payload.decode("latin1")])
+
+    def _drop_gateway(self, channel):
+        """Everyone on a gateway that died has left the game"""
+        self.unwatch(channel.sock)
+        channel.sock.close()
+        self._channels.remove(channel)
+
+        for (chan, cid), clid in list(self._sessions.items()):
+            if chan is channel:
+                del self._sessions[(chan, cid)]
+                del self._remote[clid]
+                self._handle_disconnect(clid)
+
+    def _write_gateway(self, channel):
+        """Sends a gateway what we have for it"""
+        try:
+            done = channel.write()
+        except OSError:
+            print("gateway went away")
+            self._drop_gateway(channel)
+            return
+        self.watch(channel.sock, channel.callback, write=not done)
+
+    def flush(self):
+        # each client's output is framed onto its gateway's channel, and
+        # then each gateway gets everything in one write
+        super().flush()
+        for channel in list(self._channels):
+            if channel.pending:
+                self._write_gateway(channel)
+
+    def _flush_client(self, clid, clnt):
+        data = self._take_output(clnt)
+        channel, cid = self._remote[clid]
+        channel.send(FRAME_OUTPUT, cid, data)
+
+    def _handle_disconnect(self, clid):
+        # the game is kicking them, so tell their gateway to hang up
+        remote = self._remote.pop(clid, None)
+        if remote is not None:
+            del self._sessions[remote]
+            channel, cid = remote
+            channel.send(FRAME_DISCONNECT, cid)
+        super()._handle_disconnect(clid)
+
+    def _close_client(self, clnt):
+        # the gateway owns the socket
+        pass
+
+    def _pending_connections(self):
+        queues = [self._accept_queue(x) for x in self._listen_sockets]
+        if None in queues:
+            return None
+        return sum(queues)
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats["gateways"] = len(self._channels)
+        return stats
+
+    def shutdown(self):
+        """Closes down the server. The gateways disconnect their
+        clients and exit once their channel closes.
+        """
+        self.flush()
+
+        for channel in self._channels:
+            channel.sock.close()
+        for process in self._processes:
+            process.join(5)
+        self._selector.close()
+        for listener in self._listen_sockets:
+            listener.close()
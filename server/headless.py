@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+ File Name : headless.py
+
+In-memory flavour of the MUD server. It has no sockets: players are
+connected, typed for and disconnected by calling methods, and what the
+game says to them is kept for the caller to collect. Everything in
+between, the line parsing, rate limits, event queues and output
+limits, is the regular Mud's, so a game driven through it behaves the
+way it would for real, minus the network.
+
+It is meant for driving the game from code, e.g. to run thousands of
+synthetic players through it and profile the game on its own.
+
+"""
+import selectors
+
+from server.mud import Mud
+
+
+class HeadlessMud(Mud):
+    """A MUD server with players that only exist in memory.
+
+    It takes the same options as Mud, apart from the ones about
+    sockets, and is used the same way by the game. The harness adds
+    players with 'connect', has them type with 'inject' and reads what
+    they were sent with 'collect'. With 'keep_output' off, output is
+    only counted, which keeps a long run from filling up memory.
+
+    Pass the game's clock as 'clock' when it runs on a virtual one, or
+    the rate limits and idle timeouts go by the host's clock, and how
+    fast the harness runs changes what the game gets to see.
+    """
+
+    # what each client was sent since it was last collected
+    _output = None
+    # whether to keep output for 'collect' or only count it
+    _keep_output = True
+    # bytes the game sent all told
+    bytes_out = 0
+
+    def __init__(self, keep_output=True, **kwargs):
+        self._output = {}
+        self._keep_output = keep_output
+        self.bytes_out = 0
+        kwargs.setdefault("compress", False)
+        super().__init__(**kwargs)
+
+    def _listen(self, host, port):
+        # nothing to listen on, but the selector is expected to be there
+        self._selector = selectors.DefaultSelector()
+
+    def _poll(self, timeout):
+        # nothing arrives on its own, it all comes in through 'inject', so
+        # there's never anything to wait for
+        pass
+
+    def connect(self, address="headless"):
+        """Adds a player, who shows up as a new player on the next
+        update. Returns their id.
+        """
+        clid = self._add_client(None, address)
+        self._output[clid] = bytearray()
+        return clid
+
+    def inject(self, clid, text):
+        """Has a player type 'text', which may hold several lines.
+        Each full line becomes a command on the next update, exactly as
+        if it had arrived over telnet.
+        """
+        clnt = self._clients.get(clid)
+        if clnt is None:
+            return
+        if not text.endswith("\n"):
+            text += "\n"
+        self._receive(clid, clnt, text.encode("latin1"))
+
+    def disconnect(self, clid):
+        """Has a player hang up"""
+        self._handle_disconnect(clid)
+
+    def collect(self, clid):
+        """Returns what a player was sent since the last call, as text.
+        What players that left were sent is kept until it is collected.
+        """
+        if clid in self._clients:
+            output = self._output.get(clid)
+        else:
+            output = self._output.pop(clid, None)
+        if not output:
+            return ""
+        text = output.decode("latin1")
+        output.clear()
+        return text
+
+    def _flush_client(self, clid, clnt):
+        data = self._take_output(clnt)
+        self.bytes_out += len(data)
+        if self._keep_output:
+            self._output[clid] += data
+
+    def _close_client(self, clnt):
+        # there is no connection to close
+        pass
+
+    def _pending_connections(self):
+        return 0
+
+    def shutdown(self):
+        """Closes down the server"""
+        self.flush()
+        self._selector.close()
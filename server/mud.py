@@ -16,10 +16,13 @@ server running then used to send and receive messages from players.
 
 """
 import logging
+import selectors
 import socket
-import time
-import select
+import struct
 import sys
+import time
+import zlib
+from collections import OrderedDict, deque
 from logging.handlers import SysLogHandler
 
 DEBUG = False
@@ -66,15 +69,54 @@ class Mud():
         # the ip address of this client
         address = ""
         # holds data send from the client until a full message is received
-        buffer = ""
-        # the last time we checked if the client was still connected
+        buffer = b""
+        # how far we got parsing the telnet protocol, see _process_sent_data
+        state = 1
+        # the will/wont/do/dont code waiting for its option byte
+        verb = None
+        # socket reads land here, so we don't allocate a new buffer each time
+        inbuf = b""
+        # complete lines received from the client that are still to be run
+        lines = None
+        # the last time we heard anything from the client
         lastcheck = 0
+        # encoded messages queued for this client since the last flush
+        outbox = []
+        # number of bytes waiting in 'outbox'
+        outbox_size = 0
+        # flushed bytes the socket has not accepted yet
+        pending = b""
+        # the selector events we are currently watching this client for
+        events = 0
+        # whether the client asked us to compress what we send (MCCP2)
+        mccp = False
+        # the zlib stream everything we send goes through once it's on
+        compressor = None
+        # [tokens, last refill] for each class of command the client sent
+        buckets = {}
+        # whether the command at the front of 'lines' is being held back
+        throttled = False
+        # whether the last lines they sent didn't all fit in 'lines'
+        overflowed = False
 
         def __init__(self, sock, address, buffer, lastcheck):
             self.sock = sock
             self.address = address
-            self.buffer = buffer
+            self.buffer = bytearray(buffer)
+            self.state = Mud._READ_STATE_NORMAL
+            self.verb = None
+            self.inbuf = bytearray(Mud._READ_SIZE)
+            self.lines = deque()
             self.lastcheck = lastcheck
+            self.outbox = []
+            self.outbox_size = 0
+            self.pending = bytearray()
+            self.events = selectors.EVENT_READ
+            self.mccp = False
+            self.compressor = None
+            self.buckets = {}
+            self.throttled = False
+            self.overflowed = False
 
     # Used to store different types of occurences
     _EVENT_NEW_PLAYER = 1
@@ -86,6 +128,8 @@ class Mud():
     _READ_STATE_NORMAL = 1
     _READ_STATE_COMMAND = 2
     _READ_STATE_SUBNEG = 3
+    _READ_STATE_OPTION = 4
+    _READ_STATE_SUBNEG_COMMAND = 5
 
     # Command codes used by Telnet protocol
     # See _process_sent_data function
@@ -97,147 +141,542 @@ class Mud():
     _TN_DONT = 254
     _TN_SUBNEGOTIATION_START = 250
     _TN_SUBNEGOTIATION_END = 240
+    # option 86 is MCCP2, the mud client compression protocol
+    _TN_COMPRESS2 = 86
+
+    # What to do with a client whose unsent output grows past the limit:
+    # drop new messages, throw away the queued ones or disconnect them
+    _OVERFLOW_DROP = "drop"
+    _OVERFLOW_TRUNCATE = "truncate"
+    _OVERFLOW_DISCONNECT = "disconnect"
+
+    # what happens to a command that is over its rate limit
+    _RATE_QUEUE = "queue"
+    _RATE_REJECT = "reject"
+
+    # commands per second and burst size for each class of command
+    _RATE_LIMITS = {
+        "movement": (4, 8),
+        "combat": (2, 4),
+        "info": (4, 10),
+        "chat": (2, 5),
+        "items": (2, 5),
+    }
+
+    # most bytes we read from a client socket in one go
+    _READ_SIZE = 4096
 
     # socket used to listen for new clients
     _listen_socket = None
+    # readiness multiplexer watching the listen socket and every client socket
+    _selector = None
     # holds info on clients. Maps client id to _Client object
     _clients = {}
     # counter for assigning each client a new id
     _nextid = 0
-    # list of occurences waiting to be handled by the code
-    _events = []
-    # list of newly-added occurences
-    _new_events = []
-
-    def __init__(self):
+    # occurences waiting to be handled by the code, a deque for each kind
+    _events = {}
+    # newly-added occurences, a deque for each kind
+    _new_events = {}
+    # maps a kind of occurence to the function handling it
+    _handlers = {}
+    # ids of clients with output waiting for the next flush
+    _unflushed = set()
+    # most bytes we hold for a client before the overflow policy kicks in
+    _output_limit = 0
+    # one of the _OVERFLOW_* policies
+    _overflow = None
+    # counters describing what the server has been doing
+    _stats = {}
+    # seconds a connection may sit silent before the kernel probes it
+    _keepalive = None
+    # seconds a client may stay silent before we hang up on them
+    _idle_timeout = None
+    # client ids ordered from least to most recently heard from
+    _activity = None
+    # most commands a single client gets to run per update
+    _max_lines = 0
+    # most lines a single client may have waiting to be run
+    _max_queued = 0
+    # ids of clients with lines waiting in order of arrival
+    _waiting = None
+    # how many connections the kernel may queue up for us to accept
+    _listen_backlog = 0
+    # most new clients we accept per update
+    _max_accepts = 0
+    # whether other sockets may listen on the same port as ours
+    _reuse_port = False
+    # whether we offer MCCP2 compression to new clients
+    _compress = False
+    # maps a class of command to its (per second, burst) rate limit
+    _rate_limits = None
+    # one of the _RATE_* policies
+    _rate_policy = None
+    # maps a command to its class
+    _command_classes = None
+    # class of the commands that aren't in '_command_classes'
+    _default_class = None
+    # ids of clients held back by a rate limit and when they may go again
+    _throttled = None
+    # what rate limits and idle timeouts tell the time by
+    _clock = None
+
+    def __init__(self, host="0.0.0.0", port=1234, output_limit=65536,
+                 overflow="drop", keepalive=60, idle_timeout=30 * 60,
+                 max_lines=10, max_queued=100, backlog=128, max_accepts=64,
+                 reuse_port=False, compress=True, rate_limits=None,
+                 rate_policy="queue", listen_socket=None, clock=time.time):
         """Constructs the MudServer object and starts listening for
         new players.
-        """
 
+        'output_limit' is how many bytes may pile up for a single client
+        that isn't reading them fast enough. Past that, 'overflow'
+        decides what happens: "drop" discards new messages, "truncate"
+        discards the messages queued this tick and "disconnect" kicks
+        the client.
+
+        Dead connections are found by the kernel: after 'keepalive'
+        quiet seconds it starts probing the peer, and a peer that stops
+        answering (or stops acknowledging our output) gets its socket
+        reset, which shows up as an error on the next read. Players that
+        haven't sent anything for 'idle_timeout' seconds are disconnected
+        too, half an hour by default. 0 or None lets them idle forever.
+
+        Every line a client sends becomes a command, but no more than
+        'max_lines' of one client's commands are handed out per update.
+        The rest wait for the following updates, so that a client pasting
+        a wall of text doesn't hold everyone else up. No more than
+        'max_queued' lines may be waiting at once, anything past that is
+        thrown away and the client told so.
+
+        Up to 'backlog' connections can queue in the kernel while we
+        aren't looking, and each update accepts as many of them as are
+        waiting, up to 'max_accepts'.
+
+        With 'reuse_port' the listen socket is opened with SO_REUSEPORT,
+        so that several servers can listen on the same port and the
+        kernel shares new connections out between them.
+
+        With 'compress' every new client is offered MCCP2. Those that
+        accept get everything we send them through a zlib stream of
+        their own, flushed at the end of each tick.
+
+        Each client gets a token bucket per class of command, with the
+        rate and burst size for each class given by 'rate_limits'. Which
+        command belongs to which class is up to the game, see
+        'set_command_classes'. A command over its limit is held back,
+        along with everything the client sent after it, until it fits
+        when 'rate_policy' is "queue", or thrown away with a warning to
+        the client when it is "reject".
+
+        Pass a socket that is already listening as 'listen_socket' to
+        serve it instead of opening one on 'host' and 'port'.
+
+        Rate limits and idle timeouts go by 'clock', which returns the
+        time in seconds. A game on a virtual clock should pass its own, so
+        that they run on game time too.
+        """
+        if reuse_port and not hasattr(socket, "SO_REUSEPORT"):
+            raise ValueError("SO_REUSEPORT is not supported here")
+        if overflow not in (self._OVERFLOW_DROP, self._OVERFLOW_TRUNCATE,
+                            self._OVERFLOW_DISCONNECT):
+            raise ValueError(f"unknown overflow policy: {overflow}")
+        if rate_policy not in (self._RATE_QUEUE, self._RATE_REJECT):
+            raise ValueError(f"unknown rate policy: {rate_policy}")
+
+        self._clock = clock
         self._clients = {}
         self._nextid = 0
-        self._events = []
-        self._new_events = []
+        self._events = self._event_queues()
+        self._new_events = self._event_queues()
+        self._handlers = {}
+        self._unflushed = set()
+        self._output_limit = output_limit
+        self._overflow = overflow
+        self._keepalive = keepalive
+        self._idle_timeout = idle_timeout or None
+        self._activity = OrderedDict()
+        self._max_lines = max_lines
+        self._max_queued = max_queued
+        self._waiting = OrderedDict()
+        self._listen_backlog = backlog
+        self._max_accepts = max_accepts
+        self._reuse_port = reuse_port
+        self._compress = compress
+        self._rate_limits = dict(
+            self._RATE_LIMITS if rate_limits is None else rate_limits)
+        self._rate_policy = rate_policy
+        self._command_classes = {}
+        self._default_class = None
+        self._throttled = {}
+        self._stats = {
+            "accepted": 0,
+            "accepts_deferred": 0,
+            "output_dropped": 0,
+            "output_truncated": 0,
+            "output_disconnects": 0,
+            "input_dropped": 0,
+            "compressed_in": 0,
+            "compressed_out": 0,
+            "compress_seconds": 0.0,
+        }
+        for kind in self._rate_limits:
+            self._stats["rate_limited_" + kind] = 0
+
+        if listen_socket is None:
+            self._listen(host, port)
+        else:
+            self._listen_on(listen_socket)
+
+    def _listen(self, host, port):
+        """Opens the listen socket on the given address and port"""
+        self._listen_on(self._open_listener(host, port))
+
+    def _open_listener(self, host, port):
+        """Returns a new socket listening on the given address and port"""
 
         # create a new tcp socket which will be used to listen for new clients
-        self._listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
         # set a special option on the socket which allows the port to be
         # immediately without having to wait
-        self._listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR,
-                                       1)
+        listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        # with SO_REUSEPORT every socket bound to the port gets its own accept
+        # queue, and the kernel spreads new connections across them
+        if self._reuse_port:
+            listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
         # bind the socket to an ip address and port. Port 23 is the standard
         # telnet port which telnet clients will use, however on some platforms
         # this requires root permissions, so we use a higher arbitrary port
         # number instead: 1234. Address 0.0.0.0 means that we will bind to all
         # of the available network interfaces
-        self._listen_socket.bind(("0.0.0.0", 1234))
+        listen_socket.bind((host, port))
+
+        # start listening for connections on the socket. The backlog is how
+        # many connections the kernel holds on to until we accept them; any
+        # more than that during a reconnect storm would be turned away
+        listen_socket.listen(self._listen_backlog)
+
+        return listen_socket
+
+    def _listen_on(self, listen_socket):
+        """Starts accepting clients from a socket that is already
+        listening
+        """
+
+        # a single selector (epoll on linux, kqueue on bsd/macos) tells us
+        # which sockets are ready, so checking every client costs one system
+        # call per update no matter how many players are connected
+        self._selector = selectors.DefaultSelector()
 
         # set to non-blocking mode. This means that when we call 'accept', it
         # will return immediately without waiting for a connection
+        self._listen_socket = listen_socket
         self._listen_socket.setblocking(False)
 
-        # start listening for connections on the socket
-        self._listen_socket.listen(1)
+        # watch the listen socket for new connections. Client sockets are
+        # registered with their id as the key data, the listen socket with None
+        self._selector.register(self._listen_socket, selectors.EVENT_READ, None)
 
-    def update(self):
+    def update(self, timeout=0):
         """Checks for new players, disconnected players, and new
         messages sent from players. This method must be called before
         up-to-date info can be obtained from the 'get_new_players',
         'get_disconnected_players' and 'get_commands' methods.
         It should be called in a loop to keep the game running.
+
+        If nothing has happened yet, it waits up to 'timeout' seconds
+        for something to, and returns as soon as it does. None means
+        wait for as long as it takes.
         """
 
+        # send anything that was queued since the last flush
+        self.flush()
+
         # check for new stuff
-        self._check_for_new_connections()
+        self._poll(self._wait_timeout(timeout))
         self._check_for_disconnected()
-        self._check_for_messages()
-        # self._move_monsters()
+        self._check_for_commands()
 
-        # move the new events into the main events list so that they can be
+        # move the new events into the main events queues so that they can be
         # obtained with 'get_new_players', 'get_disconnected_players' and
         # 'get_commands'. The previous events are discarded
-        self._events = list(self._new_events)
-        self._new_events = []
+        self._events = self._new_events
+        self._new_events = self._event_queues()
+
+    def wait(self, timeout):
+        """Waits up to 'timeout' seconds for something to happen, and
+        returns as soon as it does. Nothing is handed out, that is left
+        to the next 'update'. Returns whether that update has something
+        to do, which makes it a good 'sleep' for a game loop that wants
+        to hear about players as soon as they type.
+        """
+        self.flush()
+        self._poll(self._wait_timeout(timeout))
+        return self._has_new_events() or bool(self._waiting) \
+            or self._wait_timeout(None) == 0
+
+    def _wait_timeout(self, timeout):
+        """How long to wait for the sockets, given that we were asked to
+        wait 'timeout' seconds
+        """
+        # don't wait around if there is already something to hand out
+        if self._has_new_events() or self._waiting:
+            return 0
+
+        # nor past the moment a client held back by a rate limit may go on
+        if self._throttled:
+            ready = max(0, min(self._throttled.values()) - self._clock())
+            timeout = ready if timeout is None else min(timeout, ready)
+
+        # nor past the moment the quietest client would time out
+        if self._idle_timeout is not None and self._activity:
+            oldest = self._clients[next(iter(self._activity))].lastcheck
+            expiry = max(0, oldest + self._idle_timeout - self._clock())
+            timeout = expiry if timeout is None else min(timeout, expiry)
+
+        return timeout
+
+    def _event_queues(self):
+        """Returns an empty queue for each kind of occurence"""
+        return {
+            self._EVENT_NEW_PLAYER: deque(),
+            self._EVENT_PLAYER_LEFT: deque(),
+            self._EVENT_COMMAND: deque(),
+        }
+
+    def _has_new_events(self):
+        """Whether anything happened that the game hasn't been told of"""
+        return any(self._new_events.values())
+
+    def _poll(self, timeout):
+        """Handles whatever happened on the sockets since the last update"""
+
+        # ask the selector which sockets have something for us. It sleeps
+        # until at least one of them does or 'timeout' seconds have passed
+        for key, mask in self._selector.select(timeout):
+
+            # the listen socket is readable when a client is waiting to connect
+            if key.data is None:
+                self._check_for_new_connections()
+                continue
+
+            # something else that asked to be watched with 'watch'
+            if callable(key.data):
+                key.data(mask)
+                continue
+
+            # a client socket that can take more of the output we owe it
+            if mask & selectors.EVENT_WRITE:
+                self._write_pending(key.data)
+
+            # a client socket with data waiting to be read
+            if mask & selectors.EVENT_READ:
+                self._check_for_messages(key.data)
+
+    def watch(self, sock, callback, write=False):
+        """Has 'update' call 'callback' with the selector event mask
+        whenever 'sock' is readable, or writable too if 'write' is set.
+        Calling it again for the same socket changes what is watched.
+        """
+        events = selectors.EVENT_READ
+        if write:
+            events |= selectors.EVENT_WRITE
+        try:
+            self._selector.modify(sock, events, callback)
+        except KeyError:
+            self._selector.register(sock, events, callback)
+
+    def unwatch(self, sock):
+        """Stops watching a socket passed to 'watch'"""
+        self._selector.unregister(sock)
 
     def _check_for_new_connections(self):
         # print("_check_for_new_connections")
-        # 'select' is used to check whether there is data waiting to be read
-        # from the socket. We pass in 3 lists of sockets, the first being those
-        # to check for readability. It returns 3 lists, the first being
-        # the sockets that are readable. The last parameter is how long to wait
-        # - we pass in 0 so that it returns immediately without waiting
-        rlist, _, _ = select.select([self._listen_socket], [], [], 0)
-
-        # if the socket wasn't in the readable list, there's no data available,
-        # meaning no clients waiting to connect, and so we can exit the method
-        # here
-        if self._listen_socket not in rlist:
-            return
+        # there may be a whole queue of clients waiting, so keep accepting
+        # until there are none left or we've let in enough for one update.
+        # Whoever is left over gets picked up next time
+        for _ in range(self._max_accepts):
+
+            # 'accept' returns a new socket and address info which can be used
+            # to communicate with the new client. Once the queue is empty it
+            # raises an error instead of waiting
+            try:
+                joined_socket, addr = self._listen_socket.accept()
+            except BlockingIOError:
+                return
+
+            # set non-blocking mode on the new socket. This means that 'send'
+            # and 'recv' will return immediately without waiting
+            joined_socket.setblocking(False)
+            self._set_keepalive(joined_socket)
+
+            clid = self._add_client(joined_socket, addr[0])
+
+            # let the selector tell us when the new client sends us something
+            self._selector.register(joined_socket, selectors.EVENT_READ, clid)
 
-        # 'accept' returns a new socket and address info which can be used to
-        # communicate with the new client
-        joined_socket, addr = self._listen_socket.accept()
+            print("got new socket")
 
-        # set non-blocking mode on the new socket. This means that 'send' and
-        # 'recv' will return immediately without waiting
-        joined_socket.setblocking(False)
+        self._stats["accepts_deferred"] += 1
+
+    def _add_client(self, sock, address):
+        """Stores a newly connected client and returns its id number"""
 
         # construct a new _Client object to hold info about the newly connected
         # client. Use 'nextid' as the new client's id number
-        self._clients[self._nextid] = Mud._Client(joined_socket, addr[0],
-                                                  "", time.time())
+        clid = self._nextid
+        self._clients[clid] = Mud._Client(sock, address, b"", self._clock())
+
+        self._activity[clid] = None
+        self._stats["accepted"] += 1
+
+        # offer to compress what we send. Clients that can will say DO
+        if self._compress:
+            self._queue_output(clid, bytes([
+                self._TN_INTERPRET_AS_COMMAND, self._TN_WILL,
+                self._TN_COMPRESS2]))
 
         # add a new player occurence to the new events list with the player's
         # id number
-        self._new_events.append((self._EVENT_NEW_PLAYER, self._nextid))
+        self._new_events[self._EVENT_NEW_PLAYER].append(clid)
 
         # add 1 to 'nextid' so that the next client to connect will get a
         # unique id number
-        print("got new socket")
         self._nextid += 1
 
-    def _check_for_disconnected(self):
-        # go through all the clients
-        for cid, clnt in list(self._clients.items()):
+        return clid
+
+    def _set_keepalive(self, sock):
+        """Asks the kernel to watch an idle connection for us"""
+        if self._keepalive is None:
+            return
 
-            # send the client an invisible character. It doesn't actually
-            # matter what we send, we're really just checking that data can
-            # still be written to the socket. If it can't, an error will be
-            # raised and we'll know that the client has disconnected.
-            self._attempt_send(cid, "\x00")
+        # with keepalive on, a connection that has been quiet for a while
+        # gets probed by the kernel and is reset if the other end is gone.
+        # The knobs have different names (or don't exist) on some platforms
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE,
+                            self._keepalive)
+        elif hasattr(socket, "TCP_KEEPALIVE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE,
+                            self._keepalive)
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
+        if hasattr(socket, "TCP_KEEPCNT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+
+        # give up on output the client hasn't acknowledged for as long as
+        # keepalive would take to notice they are gone
+        if hasattr(socket, "TCP_USER_TIMEOUT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT,
+                            (self._keepalive + 30) * 1000)
+
+    def _check_for_disconnected(self):
+        # closed and dead connections are noticed when reading from them, so
+        # all that is left here is hanging up on clients that went quiet
+        if self._idle_timeout is None:
+            return
 
-            # update the last check time
-            clnt.lastcheck = time.time()
+        # '_activity' is ordered by when we last heard from each client, so
+        # we only ever look at the ones that have timed out plus one more
+        cutoff = self._clock() - self._idle_timeout
+        for cid in list(self._activity):
+            if self._clients[cid].lastcheck > cutoff:
+                break
+            print("idle timeout")
+            self._handle_disconnect(cid)
 
-    def _check_for_messages(self):
+    def _check_for_messages(self, pid):
         # print("_check_for_messages")
-        # go through all the clients
-        for pid, clnt in list(self._clients.items()):
-
-            # we use 'select' to test whether there is data waiting to be read
-            # from the client socket. The function takes 3 lists of sockets,
-            # the first being those to test for readability. It returns 3 list
-            # of sockets, the first being those that are actually readable.
-            rlist, _, _ = select.select([clnt.sock], [], [], 0)
-
-            # if the client socket wasn't in the readable list, there is no
-            # new data from the client - we can skip it and move on to the next
-            # one
-            if clnt.sock not in rlist:
-                continue
+        # the selector only hands us clients whose socket is readable, so
+        # there is new data waiting for us
+        clnt = self._clients.get(pid)
+        if clnt is None:
+            return
 
-            try:
-                # read data from the socket, using a max length of 4096
-                data = clnt.sock.recv(4096).decode("latin1")
+        try:
+            # read data from the socket straight into the client's own buffer,
+            # using a max length of 4096
+            size = clnt.sock.recv_into(clnt.inbuf)
+
+        # if there is a problem reading from the socket (e.g. the client
+        # has disconnected) a socket error will be raised
+        except socket.error:
+            print("socket error in _check_for_messages")
+            self._handle_disconnect(pid)
+            return
+
+        # reading nothing from a readable socket means the client closed it
+        if not size:
+            self._handle_disconnect(pid)
+            return
+
+        self._receive(pid, clnt, clnt.inbuf, size)
+
+    def _receive(self, pid, clnt, data, size=None):
+        """Turns raw bytes read from a client into lines waiting to be run"""
+
+        # remember that we've just heard from them
+        clnt.lastcheck = self._clock()
+        self._activity.move_to_end(pid)
+
+        # process the data, stripping out any special Telnet commands. Every
+        # message that was completed waits its turn on the client
+        messages = self._process_sent_data(clnt, data, size)
+        if messages:
+            self._queue_lines(pid, clnt, messages)
 
-                # process the data, stripping out any special Telnet commands
-                message = self._process_sent_data(clnt, data)
+    def _queue_lines(self, pid, clnt, messages):
+        """Puts lines a client sent at the back of their queue, as many
+        of them as fit under '_max_queued'
+        """
+        room = self._max_queued - len(clnt.lines)
+        if len(messages) > room:
+            # the queue only fills up this far when someone pastes a lot
+            # more than they could ever run, so the rest is thrown away
+            # rather than held for them. They're told when it starts, not
+            # for every line that doesn't fit
+            room = max(room, 0)
+            self._stats["input_dropped"] += len(messages) - room
+            if not clnt.overflowed:
+                self.send_message(pid, "You sent too much at once, the "
+                                       "rest was ignored.")
+            clnt.overflowed = True
+            messages = messages[:room]
+        else:
+            clnt.overflowed = False
+
+        clnt.lines.extend(messages)
+        if clnt.lines and pid not in self._throttled:
+            self._waiting[pid] = None
+
+    def _check_for_commands(self):
+        """Turns waiting lines into command events, taking no more than
+        '_max_lines' from each client.
+        """
+        now = self._clock()
+
+        # clients whose rate limit has let up join the back of the queue
+        for pid, ready in list(self._throttled.items()):
+            if ready <= now:
+                del self._throttled[pid]
+                self._waiting[pid] = None
+
+        for pid in list(self._waiting):
+            clnt = self._clients.get(pid)
+            if clnt is None:
+                del self._waiting[pid]
+                continue
+
+            for _ in range(min(self._max_lines, len(clnt.lines))):
+                message = clnt.lines[0]
 
                 # if there was a message in the data
                 if message:
-                    print("got message")
                     # remove any spaces, tabs etc from the start and end of
                     # the message
                     message = message.strip()
@@ -245,49 +684,207 @@ class Mud():
                     # separate the message into the command (the first word)
                     # and its parameters (the rest of the message)
                     command, params = (message.split(" ", 1) + ["", ""])[:2]
+                    command = command.lower()
+
+                    # commands over their limit either wait, and everything
+                    # sent after them with them, or are thrown away
+                    ready = self._take_token(clnt, command, now)
+                    if ready is not None:
+                        if self._rate_policy == self._RATE_QUEUE:
+                            self._throttled[pid] = ready
+                            break
+                        clnt.lines.popleft()
+                        self.send_message(pid, "You're doing that too fast.")
+                        continue
 
+                    print("got message")
                     # add a command occurence to the new events list with the
                     # player's id number, the command and its parameters
-                    self._new_events.append((self._EVENT_COMMAND, pid,
-                                             command.lower(), params))
+                    self._new_events[self._EVENT_COMMAND].append(
+                        (pid, command, params))
+
+                clnt.lines.popleft()
+
+            # clients that still have lines left go to the back of the queue,
+            # unless they're waiting on a rate limit
+            del self._waiting[pid]
+            if clnt.lines and pid not in self._throttled:
+                self._waiting[pid] = None
+
+    def set_command_classes(self, classes, default=None):
+        """Tells the server which class of rate limit each command
+        falls under. 'classes' maps a command (as it appears in
+        'get_commands') to a class given in 'rate_limits'. Commands
+        that aren't in it count against 'default', or are never limited
+        when that is None.
+        """
+        self._command_classes = dict(classes)
+        self._default_class = default
 
-            # if there is a problem reading from the socket (e.g. the client
-            # has disconnected) a socket error will be raised
-            except socket.error:
-                print("socket error in _check_for_messages")
-                self._handle_disconnect(pid)
+    def _take_token(self, clnt, command, now):
+        """Charges a command to the client's rate limit. Returns None if
+        it may go ahead, otherwise the time it will be allowed.
+        """
+        kind = self._command_classes.get(command, self._default_class)
+        if kind not in self._rate_limits:
+            return None
+        rate, burst = self._rate_limits[kind]
+
+        # the bucket refills at 'rate' tokens a second up to 'burst', and
+        # each command takes one token out
+        bucket = clnt.buckets.setdefault(kind, [burst, now])
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            clnt.throttled = False
+            return None
+
+        # only count a command the first time it is held back
+        if not clnt.throttled:
+            self._stats["rate_limited_" + kind] += 1
+        clnt.throttled = self._rate_policy == self._RATE_QUEUE
+        return now + (1 - bucket[0]) / rate
+
+    def _queue_output(self, clid, data):
+        """Adds encoded bytes to a client's output for the next flush"""
+        clnt = self._clients.get(clid)
+        if clnt is None:
+            return
 
-    def _attempt_send(self, clid, data):
-        # python 2/3 compatability fix - convert non-unicode string to unicode
-        if sys.version < '3' and not isinstance(data, str):
-            data = str(data, "latin1")
+        # the client isn't keeping up with what we send them, so apply the
+        # overflow policy before queueing anything else
+        if self._backlog(clnt) + len(data) > self._output_limit:
+
+            if self._overflow == self._OVERFLOW_DISCONNECT:
+                print("output overflow, disconnecting")
+                self._stats["output_disconnects"] += 1
+                self._handle_disconnect(clid)
+                return
+
+            if self._overflow == self._OVERFLOW_TRUNCATE and clnt.outbox:
+                self._stats["output_truncated"] += len(clnt.outbox)
+                clnt.outbox = []
+                clnt.outbox_size = 0
+
+            if self._backlog(clnt) + len(data) > self._output_limit:
+                self._stats["output_dropped"] += 1
+                return
+
+        clnt.outbox.append(data)
+        clnt.outbox_size += len(data)
+        self._unflushed.add(clid)
+
+    def _backlog(self, clnt):
+        """Number of bytes owed to a client that it hasn't taken yet"""
+        return len(clnt.pending) + clnt.outbox_size
+
+    def flush(self):
+        """Sends every client the messages queued for them since the
+        last flush, one write per client. Call it once the game has
+        finished handling a tick.
+        """
+        unflushed = self._unflushed
+        self._unflushed = set()
+
+        for clid in unflushed:
+            clnt = self._clients.get(clid)
+            if clnt is not None and clnt.outbox:
+                self._flush_client(clid, clnt)
+
+    def _flush_client(self, clid, clnt):
+        """Moves a client's queued messages onto the wire"""
+        clnt.pending += self._take_output(clnt)
+        self._write_pending(clid)
+
+    def _take_output(self, clnt):
+        """Empties a client's outbox, returning the bytes to send"""
+        data = b"".join(clnt.outbox)
+        clnt.outbox = []
+        clnt.outbox_size = 0
+
+        # compression is switched on and off in between ticks, so all of a
+        # tick's output is either compressed or it isn't
+        prefix = b""
+        if clnt.mccp and clnt.compressor is None:
+            prefix = bytes([self._TN_INTERPRET_AS_COMMAND,
+                            self._TN_SUBNEGOTIATION_START, self._TN_COMPRESS2,
+                            self._TN_INTERPRET_AS_COMMAND,
+                            self._TN_SUBNEGOTIATION_END])
+            clnt.compressor = zlib.compressobj()
+        elif not clnt.mccp and clnt.compressor is not None:
+            prefix = clnt.compressor.flush(zlib.Z_FINISH)
+            clnt.compressor = None
+
+        if clnt.compressor is None:
+            return prefix + data
+
+        # the stream lives as long as the client does, so each tick only pays
+        # for what is new. A sync flush at the end of the tick gets it all
+        # to the client without waiting for more
+        start = time.perf_counter()
+        packed = clnt.compressor.compress(data)
+        packed += clnt.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self._stats["compress_seconds"] += time.perf_counter() - start
+        self._stats["compressed_in"] += len(data)
+        self._stats["compressed_out"] += len(packed)
+        return prefix + packed
+
+    def _write_pending(self, clid):
+        """Writes as much of a client's pending output as the socket takes"""
+        clnt = self._clients.get(clid)
+        if clnt is None:
+            return
 
         try:
-            # look up the client in the client map and use 'sendall' to send
-            # the message string on the socket. 'sendall' ensures that all of
-            # the data is sent in one go
-            self._clients[clid].sock.sendall(bytearray(data, "latin1"))
-        # KeyError will be raised if there is no client with the given id in
-        # the map
-        except KeyError:
-            pass
+            # a non-blocking 'send' writes what fits in the socket buffer and
+            # tells us how much that was. The rest waits for the selector to
+            # say the socket is writable again
+            sent = clnt.sock.send(clnt.pending) if clnt.pending else 0
+        except BlockingIOError:
+            sent = 0
         # If there is a connection problem with the client (e.g. they have
         # disconnected) a socket error will be raised
         except socket.error:
             print("got disconnect")
             self._handle_disconnect(clid)
+            return
+
+        del clnt.pending[:sent]
+
+        # only ask to hear about writability while we still owe them data
+        events = selectors.EVENT_READ
+        if clnt.pending:
+            events |= selectors.EVENT_WRITE
+        if events != clnt.events:
+            clnt.events = events
+            self._selector.modify(clnt.sock, events, clid)
 
     def _handle_disconnect(self, clid):
 
         # remove the client from the clients map
         print("handle disconnect")
-        del self._clients[clid]
+        clnt = self._clients.pop(clid, None)
+        if clnt is None:
+            return
+        del self._activity[clid]
+        self._throttled.pop(clid, None)
+
+        self._close_client(clnt)
 
         # add a 'player left' occurence to the new events list, with the
         # player's id number
-        self._new_events.append((self._EVENT_PLAYER_LEFT, clid))
+        self._new_events[self._EVENT_PLAYER_LEFT].append(clid)
 
-    def _process_sent_data(self, client, data):
+    def _close_client(self, clnt):
+        """Releases the connection of a client that has left"""
+
+        # stop watching the socket and close it so the client sees the
+        # connection drop and we don't leak file descriptors
+        self._selector.unregister(clnt.sock)
+        clnt.sock.close()
+
+    def _process_sent_data(self, client, data, size=None):
 
         # the Telnet protocol allows special command codes to be inserted into
         # messages. For our very simple server we don't need to response to
@@ -296,124 +893,200 @@ class Mud():
         # More info on the Telnet protocol can be found here:
         # http://pcmicro.com/netfoss/telnet.html
 
-        # start with no message and in the normal state
-        message = None
-        state = self._READ_STATE_NORMAL
+        # 'data' is a bytes-like object of which the first 'size' bytes are
+        # new. Anything that doesn't finish a line or a telnet command is kept
+        # on the client, so it doesn't matter how the input was split up into
+        # packets. Rather than looking at one byte at a time we use 'find' to
+        # jump straight to the next byte that means something to us
+        end = len(data) if size is None else size
+        view = memoryview(data)
+        buffer = client.buffer
+        state = client.state
+        messages = []
+        pos = 0
 
-        # go through the data a character at a time
-        for char in data:
+        while pos < end:
 
-            # handle the character differently depending on the state we're in:
+            # handle the next bytes differently depending on the state we're in:
 
             # normal state
             if state == self._READ_STATE_NORMAL:
 
+                # regular text runs up to the next 'interpret as command' code
+                stop = data.find(b"\xff", pos, end)
+                if stop < 0:
+                    stop = end
+
+                # every newline character in the text ends a message. The
+                # first one finishes whatever is already in the buffer, and
+                # the text after the last one starts the next message
+                pieces = view[pos:stop].tobytes().split(b"\n")
+                for piece in pieces[:-1]:
+                    if buffer or b"\x08" in piece:
+                        self._buffer_text(buffer, piece)
+                        messages.append(buffer.decode("latin1"))
+                        del buffer[:]
+                    else:
+                        messages.append(piece.decode("latin1"))
+                self._buffer_text(buffer, pieces[-1])
+                pos = stop + 1
+
                 # if we received the special 'interpret as command' code,
                 # switch to 'command' state so that we handle the next
-                # character as a command code and not as regular text data
-                if ord(char) == self._TN_INTERPRET_AS_COMMAND:
+                # byte as a command code and not as regular text data
+                if stop < end:
                     state = self._READ_STATE_COMMAND
 
-                # if we get a newline character, this is the end of the
-                # message. Set 'message' to the contents of the buffer and
-                # clear the buffer
-                elif char == "\n":
-                    message = client.buffer
-                    client.buffer = ""
-
-                # some telnet clients send the characters as soon as the user
-                # types them. So if we get a backspace character, this is where
-                # the user has deleted a character and we should delete the
-                # last character from the buffer.
-                elif char == "\x08":
-                    client.buffer = client.buffer[:-1]
-
-                # otherwise it's just a regular character - add it to the
-                # buffer where we're building up the received message
-                else:
-                    client.buffer += char
-
             # command state
             elif state == self._READ_STATE_COMMAND:
+                code = data[pos]
+                pos += 1
 
                 # the special 'start of subnegotiation' command code indicates
-                # that the following characters are a list of options until
-                # we're told otherwise. We switch into 'subnegotiation' state
-                # to handle this
-                if ord(char) == self._TN_SUBNEGOTIATION_START:
+                # that the following bytes are a list of options until we're
+                # told otherwise. We switch into 'subnegotiation' state to
+                # handle this
+                if code == self._TN_SUBNEGOTIATION_START:
                     state = self._READ_STATE_SUBNEG
 
                 # if the command code is one of the 'will', 'wont', 'do' or
-                # 'dont' commands, the following character will be an option
-                # code so we must remain in the 'command' state
-                elif ord(char) in (self._TN_WILL, self._TN_WONT, self._TN_DO,
-                                   self._TN_DONT):
-                    state = self._READ_STATE_COMMAND
+                # 'dont' commands, the following byte will be an option code
+                elif code in (self._TN_WILL, self._TN_WONT, self._TN_DO,
+                              self._TN_DONT):
+                    client.verb = code
+                    state = self._READ_STATE_OPTION
+
+                # two 'interpret as command' codes in a row stand for one
+                # byte of text with that value
+                elif code == self._TN_INTERPRET_AS_COMMAND:
+                    buffer.append(code)
+                    state = self._READ_STATE_NORMAL
 
                 # for all other command codes, there is no accompanying data so
                 # we can return to 'normal' state.
                 else:
                     state = self._READ_STATE_NORMAL
 
+            # option state
+            elif state == self._READ_STATE_OPTION:
+                self._handle_negotiation(client, client.verb, data[pos])
+                pos += 1
+                state = self._READ_STATE_NORMAL
+
             # subnegotiation state
             elif state == self._READ_STATE_SUBNEG:
 
+                # the options are ended by 'interpret as command' followed by
+                # 'end of subnegotiation'. Skip ahead to the next command code
+                stop = data.find(b"\xff", pos, end)
+                if stop < 0:
+                    break
+                pos = stop + 1
+                state = self._READ_STATE_SUBNEG_COMMAND
+
+            # command code inside a subnegotiation
+            elif state == self._READ_STATE_SUBNEG_COMMAND:
+
                 # if we reach an 'end of subnegotiation' command, this ends the
                 # list of options and we can return to 'normal' state.
-                # Otherwise we must remain in this state
-                if ord(char) == self._TN_SUBNEGOTIATION_END:
+                # Otherwise we must remain in 'subnegotiation' state
+                if data[pos] == self._TN_SUBNEGOTIATION_END:
                     state = self._READ_STATE_NORMAL
+                else:
+                    state = self._READ_STATE_SUBNEG
+                pos += 1
+
+        client.state = state
+
+        # return every message that was completed, oldest first
+        return messages
+
+    @staticmethod
+    def _buffer_text(buffer, text):
+        """Adds text to a client's buffer, applying any backspaces"""
+
+        # some telnet clients send the characters as soon as the user types
+        # them. So if we get a backspace character, this is where the user has
+        # deleted a character and we should delete the last character from
+        # the buffer.
+        if b"\x08" in text:
+            pieces = text.split(b"\x08")
+            for piece in pieces[:-1]:
+                buffer += piece
+                del buffer[-1:]
+            text = pieces[-1]
 
-        # return the contents of 'message' which is either a string or None
-        return message
+        # otherwise it's just regular characters
+        buffer += text
+
+    def _handle_negotiation(self, client, verb, option):
+        """Called with each telnet option the client negotiates"""
+
+        # the client's answer to our offer of compression. It starts, or
+        # stops, with the next output we send
+        if option == self._TN_COMPRESS2 and self._compress:
+            client.mccp = verb == self._TN_DO
 
     def get_new_players(self):
-        """Returns a list containing info on any new players that have
+        """Returns a deque containing info on any new players that have
         entered the game since the last call to 'update'. Each item in
-        the list is a player id number.
+        the deque is a player id number.
         """
-        retval = []
-        # go through all the events in the main list
-        # print("get_new_players events: {}".format(self._events))
-        for event in self._events:
-            # if the event is a new player occurence, add the info to the list
-            if event[0] == self._EVENT_NEW_PLAYER:
-                retval.append(event[1])
-        # return the info list
-        return retval
+        return self._events[self._EVENT_NEW_PLAYER]
 
     def get_disconnected_players(self):
-        """Returns a list containing info on any players that have left
-        the game since the last call to 'update'. Each item in the list
+        """Returns a deque containing info on any players that have left
+        the game since the last call to 'update'. Each item in the deque
         is a player id number.
         """
-        retval = []
-        # go through all the events in the main list
-        for event in self._events:
-            # if the event is a player disconnect occurence, add the info to
-            # the list
-            if event[0] == self._EVENT_PLAYER_LEFT:
-                retval.append(event[1])
-        # return the info list
-        return retval
+        return self._events[self._EVENT_PLAYER_LEFT]
 
     def get_commands(self):
-        """Returns a list containing any commands sent from players
-        since the last call to 'update'. Each item in the list is a
+        """Returns a deque containing any commands sent from players
+        since the last call to 'update'. Each item in the deque is a
         3-tuple containing the id number of the sending player, a
         string containing the command (i.e. the first word of what
         they typed), and another string containing the text after the
         command
         """
-        retval = []
-        # go through all the events in the main list
-        # print(self._events)
-        for event in self._events:
-            # if the event is a command occurence, add the info to the list
-            if event[0] == self._EVENT_COMMAND:
-                retval.append((event[1], event[2], event[3]))
-        # return the info list
-        return retval
+        return self._events[self._EVENT_COMMAND]
+
+    def on_new_player(self, handler):
+        """Has 'dispatch_events' call 'handler' with the id number of
+        each new player
+        """
+        self._handlers[self._EVENT_NEW_PLAYER] = handler
+
+    def on_player_left(self, handler):
+        """Has 'dispatch_events' call 'handler' with the id number of
+        each player that left
+        """
+        self._handlers[self._EVENT_PLAYER_LEFT] = handler
+
+    def on_command(self, handler):
+        """Has 'dispatch_events' call 'handler' with the id number of
+        the player, the command and its parameters for each command
+        """
+        self._handlers[self._EVENT_COMMAND] = handler
+
+    def dispatch_events(self):
+        """Hands the events from the last call to 'update' to the
+        registered handlers: new players first, then the players that
+        left, then the commands. Each event is handled once, and kinds
+        without a handler are left for the 'get_*' methods.
+        """
+        for kind in (self._EVENT_NEW_PLAYER, self._EVENT_PLAYER_LEFT,
+                     self._EVENT_COMMAND):
+            handler = self._handlers.get(kind)
+            if handler is None:
+                continue
+            events = self._events[kind]
+            while events:
+                event = events.popleft()
+                if kind == self._EVENT_COMMAND:
+                    handler(*event)
+                else:
+                    handler(event)
 
     def send_message(self, to_player, message):
         """Sends the text in the 'message' parameter to the player with
@@ -421,22 +1094,145 @@ class Mud():
         printed out in the player's terminal.
         """
         # we make sure to put a newline on the end so the client receives the
-        # message on its own line
-        self._attempt_send(to_player, message+"\n\r")
+        # message on its own line. It goes out with the next flush
+        self._queue_output(to_player, bytes(message+"\n\r", "latin1"))
+
+    def multicast(self, recipients, message):
+        """Sends the same text to every player id in 'recipients'. The
+        text is only encoded once, and each player's output holds the
+        same bytes.
+        """
+        data = bytes(message+"\n\r", "latin1")
+        for to_player in recipients:
+            self._queue_output(to_player, data)
+
+    def get_stats(self):
+        """Returns a dictionary of counters describing the server"""
+        stats = dict(self._stats)
+        stats["connected"] = len(self._clients)
+        stats["pending"] = self._pending_connections()
+        stats["compressed_clients"] = sum(
+            1 for clnt in self._clients.values() if clnt.compressor is not None)
+        if stats["compressed_out"]:
+            stats["compression_ratio"] = (stats["compressed_in"]
+                                          / stats["compressed_out"])
+        return stats
+
+    def _pending_connections(self):
+        """Number of connections waiting to be accepted, if we can tell"""
+        return self._accept_queue(self._listen_socket)
+
+    @staticmethod
+    def _accept_queue(listen_socket):
+        """Length of a listen socket's accept queue, if we can tell"""
+
+        # on linux the tcp_info of a listening socket holds the length of its
+        # accept queue where the unacknowledged segment count usually goes
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            info = listen_socket.getsockopt(
+                socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+        except (AttributeError, OSError):
+            return None
+        return struct.unpack_from("I", info, 24)[0]
 
     def get_disconnect(self, clid):
         """non-protected method for gracefully allowing a player to disconnect
         """
+        # give them whatever we still had to say before hanging up
+        clnt = self._clients.get(clid)
+        if clnt is not None and clnt.outbox:
+            self._flush_client(clid, clnt)
         self._handle_disconnect(clid)
 
+    def handoff(self):
+        """Gets the server ready to be taken over by another process,
+        see 'restore'. Returns its state, which can be pickled, and the
+        sockets to pass on, the listen socket first. The connections
+        stay open until both processes have closed them.
+        """
+        self.flush()
+
+        clients = []
+        sockets = [self._listen_socket]
+        for clid in self._activity:
+            clnt = self._clients[clid]
+
+            # a zlib stream can't be moved, so end it here. The client still
+            # wants compression, so the next process starts a fresh one
+            if clnt.compressor is not None:
+                clnt.pending += clnt.compressor.flush(zlib.Z_FINISH)
+                clnt.compressor = None
+
+            clients.append({
+                "id": clid,
+                "address": clnt.address,
+                "buffer": bytes(clnt.buffer),
+                "state": clnt.state,
+                "verb": clnt.verb,
+                "lines": list(clnt.lines),
+                "lastcheck": clnt.lastcheck,
+                "pending": bytes(clnt.pending),
+                "mccp": clnt.mccp,
+                "buckets": clnt.buckets,
+                "throttled": clnt.throttled,
+            })
+            sockets.append(clnt.sock)
+
+        state = {
+            "nextid": self._nextid,
+            "stats": self._stats,
+            "clients": clients,
+            "waiting": list(self._waiting),
+            "throttled": self._throttled,
+        }
+        return state, sockets
+
+    def restore(self, state, sockets):
+        """Takes over the clients of a server that called 'handoff',
+        given its state and client sockets. Nobody is told anything:
+        as far as the game is concerned they never left.
+        """
+        self._nextid = state["nextid"]
+        self._stats.update(state["stats"])
+
+        for info, sock in zip(state["clients"], sockets):
+            sock.setblocking(False)
+            clid = info["id"]
+            clnt = Mud._Client(sock, info["address"], info["buffer"],
+                               info["lastcheck"])
+            clnt.state = info["state"]
+            clnt.verb = info["verb"]
+            clnt.lines.extend(info["lines"])
+            clnt.pending += info["pending"]
+            clnt.mccp = info["mccp"]
+            clnt.buckets = info["buckets"]
+            clnt.throttled = info["throttled"]
+
+            self._clients[clid] = clnt
+            self._activity[clid] = None
+            self._selector.register(sock, selectors.EVENT_READ, clid)
+
+            # send whatever the last process didn't get to
+            if clnt.pending:
+                self._write_pending(clid)
+
+        for clid in state["waiting"]:
+            self._waiting[clid] = None
+        self._throttled.update(state["throttled"])
+
     def shutdown(self):
         """Closes down the server, disconnecting all clients and
         closing the listen socket.
         """
+        self.flush()
+
         # for each client
         for clnt in self._clients.values():
             # close the socket, disconnecting the client
             clnt.sock.shutdown(socket.SHUT_RDWR)
             clnt.sock.close()
         # stop listening for new clients
+        self._selector.close()
         self._listen_socket.close()
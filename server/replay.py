@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""
+ File Name : replay.py
+
+Recording and replaying what happened to a game. A Recorder sits
+between the server and the game and writes down every event the game
+is handed, along with the time it got it and the seed its random
+numbers came from. It also writes down when each tick of the game loop
+started, which is the time the game reads for the whole tick, and
+whether input woke the loop up for it. ReplayMud stands in for the
+server later on, with no sockets at all, and steps a fresh game
+through exactly the same ticks on a virtual clock, handing it the same
+events in the same ticks.
+
+A replay runs as fast as the CPU allows and plays out like the
+recorded game did, bit for bit, so it can be timed to see what a change
+to the game costs, and the digest of everything the game said shows
+whether it behaved the same.
+
+"""
+import hashlib
+import json
+import struct
+import time
+from collections import deque
+
+from server.headless import HeadlessMud
+
+# the kinds of event in a recording
+_NEW = "new"
+_LEFT = "left"
+_COMMAND = "command"
+_TICK = "tick"
+
+
+class Recorder():
+    """Writes the events handed to 'game' to the file at 'path'.
+
+    Register it with the server in place of the game, i.e. pass its
+    'new_player', 'player_left' and 'new_command' to the server's
+    'on_*' methods, and it passes every event on to the game once it
+    is written down. 'clock' should be the game's clock, and 'tick'
+    called each time a tick starts.
+    """
+
+    def __init__(self, path, game, seed, clock=time.time):
+        self._game = game
+        self._clock = clock
+        # one json document per line, written as they happen so that a
+        # crash only loses the line being written
+        self._file = open(path, "w", encoding="utf-8", buffering=1)
+        self._write({"seed": seed, "start": clock()})
+
+    def _write(self, record):
+        """Adds a line to the recording"""
+        self._file.write(json.dumps(record) + "\n")
+
+    def tick(self, now, woke):
+        """Records a tick starting at 'now', and whether input woke the
+        loop up for it
+        """
+        self._write([now, _TICK, woke])
+
+    def new_player(self, pid):
+        """Records a new player and tells the game"""
+        self._write([self._clock(), _NEW, pid])
+        self._game.new_player(pid)
+
+    def player_left(self, pid):
+        """Records a player leaving and tells the game"""
+        self._write([self._clock(), _LEFT, pid])
+        self._game.player_left(pid)
+
+    def new_command(self, pid, command, params):
+        """Records a command and hands it to the game"""
+        self._write([self._clock(), _COMMAND, pid, command, params])
+        self._game.new_command(pid, command, params)
+
+    def close(self):
+        """Finishes the recording"""
+        self._file.close()
+
+
+def load(path):
+    """Reads a recording. Returns its header, holding the seed and the
+    time it started, and its events, oldest first.
+    """
+    with open(path, encoding="utf-8") as stream:
+        header = json.loads(stream.readline())
+        events = deque(json.loads(line) for line in stream if line.strip())
+    return header, events
+
+
+class ReplayMud(HeadlessMud):
+    """A server without sockets that plays back a recording.
+
+    Use its 'sleep' as the ticker's, which moves 'clock', the clock the
+    game runs on, on to the time the next recorded tick started. Each
+    'update' then hands out the recorded events whose time has come.
+    The players get the same ids they had when the recording was made.
+    What the game says to them goes nowhere, but is counted and goes
+    into 'digest'.
+    """
+
+    # the recorded events not played back yet
+    _recorded = None
+    # (time, woken by input) for each recorded tick not played back yet
+    _ticks = None
+    # whether the ticks ran out, and the clock went on without them
+    _ticks_over = False
+    # the clock the recording plays back on
+    _clock = None
+    # hash of everything the game said, and to whom
+    _digest = None
+
+    def __init__(self, events, clock, **kwargs):
+        self._recorded = deque(x for x in events if x[1] != _TICK)
+        self._ticks = deque((x[0], x[2]) for x in events if x[1] == _TICK)
+        self._ticks_over = False
+        self._clock = clock
+        self._digest = hashlib.sha256()
+        kwargs["compress"] = False
+        # players who went idle left in the recording, and the commands
+        # played back don't count as hearing from anyone
+        kwargs["idle_timeout"] = None
+        super().__init__(keep_output=False, clock=clock, **kwargs)
+
+    def update(self, timeout=0):
+        """Hands out the recorded events that are due. It never waits,
+        the clock only moves when the game's loop moves it.
+        """
+        now = self._clock()
+        recorded = self._recorded
+        while recorded and recorded[0][0] <= now:
+            _, kind, pid, *rest = recorded.popleft()
+
+            if kind == _NEW:
+                clid = self.connect("replay")
+                if clid != pid:
+                    raise ValueError(
+                        f"recording expected player {pid}, got {clid}")
+
+            elif kind == _LEFT:
+                # the game may have hung up on them itself, like it did when
+                # this was recorded, in which case they're already gone
+                self._handle_disconnect(pid)
+
+            elif pid in self._clients:
+                command, params = rest
+                self._new_events[self._EVENT_COMMAND].append(
+                    (pid, command, params))
+
+        self._events = self._new_events
+        self._new_events = self._event_queues()
+
+    def sleep(self, timeout):
+        """Moves the clock on to the next recorded tick. Returns whether
+        input woke the loop up for it, like it did when it was recorded.
+        Past the last one, the clock moves on by 'timeout'.
+        """
+        if not self._ticks:
+            self._ticks_over = True
+            self._clock.sleep(timeout)
+            return False
+
+        self._clock.now, woke = self._ticks.popleft()
+        return woke
+
+    def finished(self):
+        """Whether every recorded tick was played back and every event
+        handed out
+        """
+        return self._ticks_over and not self._recorded
+
+    def digest(self):
+        """Hex digest of everything the game said so far, and to whom"""
+        return self._digest.hexdigest()
+
+    def _flush_client(self, clid, clnt):
+        data = self._take_output(clnt)
+        self._digest.update(struct.pack("!II", clid, len(data)))
+        self._digest.update(data)
+        self.bytes_out += len(data)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+ File Name : threaded_mud.py
+
+Threaded flavour of the MUD server. A regular Mud runs on a thread of
+its own, reading, parsing and writing, while the game thread only ever
+touches the game. Events travel to the game through a queue, and
+whatever the game says travels back through another one, so a slow
+client or a big burst of input no longer holds up the game's tick.
+
+"""
+import queue
+import socket
+import threading
+import traceback
+from collections import deque
+
+from server.mud import Mud
+
+
+class ThreadedMud(Mud):
+    """A MUD server doing its network work on a separate thread.
+
+    It takes the same options as Mud and is used the same way: call
+    'update' in the game loop, then read the events with the 'get_*'
+    methods or 'dispatch_events', and 'flush' once the tick is done.
+    The events are those the network thread has handed over since the
+    last 'update'.
+    """
+
+    # settings for the Mud on the network thread
+    _options = None
+    # the Mud owning the sockets. Only the network thread touches it
+    _io = None
+    # the network thread
+    _thread = None
+    # batches of events on their way from the network thread to the game
+    _inbox = None
+    # (client id, bytes) on their way to the network thread. No bytes
+    # means the game wants the client disconnected, and no client id is a
+    # request for the stats, to be put on the queue given instead of bytes
+    _outbox = None
+    # the ends of the socket pair used to wake the network thread up
+    _wakeup = None
+    _waker = None
+    # set when the network thread should stop
+    _stopping = False
+    # whatever killed the network thread, if it died
+    _failure = None
+    # batches 'wait' took off the inbox, for the next 'update'
+    _early = None
+
+    def __init__(self, host="0.0.0.0", port=1234, **kwargs):
+        self._options = dict(kwargs)
+        self._inbox = queue.Queue()
+        self._outbox = deque()
+        self._stopping = False
+        self._failure = None
+        self._early = []
+        super().__init__(host, port, **kwargs)
+
+    def _listen(self, host, port):
+        # the sockets all belong to the Mud on the network thread. We only
+        # keep a socket pair so that the game can tell it there's output
+        self._io = Mud(host, port, **self._options)
+        self._listen_socket = self._io._listen_socket
+        self._wakeup, self._waker = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._waker.setblocking(False)
+        self._io.watch(self._wakeup, self._on_wakeup)
+
+        self._thread = threading.Thread(target=self._run, name="mud-io",
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        """The network thread: runs the Mud and passes its events on"""
+        io = self._io
+        try:
+            while not self._stopping:
+                io.update(None)
+
+                # hand over this update's events as a batch. The Mud starts
+                # fresh queues on every update, so these are the game's now
+                if any(io._events.values()):
+                    self._inbox.put(io._events)
+        except Exception as exc:  # pylint: disable=broad-except
+            traceback.print_exc()
+            self._failure = exc
+            self._inbox.put(None)
+        finally:
+            io.shutdown()
+
+    def _on_wakeup(self, mask):
+        """Network thread: sends what the game queued for its clients"""
+        try:
+            while self._wakeup.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        io = self._io
+        outbox = self._outbox
+        while outbox:
+            clid, data = outbox.popleft()
+            if clid is None:
+                data.put(io.get_stats())
+            elif data is None:
+                io.get_disconnect(clid)
+            else:
+                io._queue_output(clid, data)
+        io.flush()
+
+    def _wake(self):
+        """Game thread: gets the network thread's attention"""
+        try:
+            self._waker.send(b"\0")
+        except BlockingIOError:
+            # it hasn't read the last ones yet, so it'll be round anyway
+            pass
+
+    def update(self, timeout=0):
+        """Collects the events the network thread has seen since the
+        last call, waiting up to 'timeout' seconds for there to be some.
+        None means wait for as long as it takes.
+        """
+        batches, self._early = self._early, []
+        try:
+            if timeout == 0 or batches:
+                batches.append(self._inbox.get_nowait())
+            else:
+                batches.append(self._inbox.get(timeout=timeout))
+            while True:
+                batches.append(self._inbox.get_nowait())
+        except queue.Empty:
+            pass
+
+        self._events = self._event_queues()
+        for batch in batches:
+            if batch is None:
+                raise RuntimeError("network thread died") from self._failure
+            for kind, events in batch.items():
+                self._events[kind].extend(events)
+
+    def wait(self, timeout):
+        """Waits up to 'timeout' seconds for the network thread to hand
+        over some events, which the next 'update' collects. Returns
+        whether there are any.
+        """
+        self.flush()
+        if not self._early:
+            try:
+                self._early.append(self._inbox.get(timeout=timeout))
+            except queue.Empty:
+                pass
+        return bool(self._early)
+
+    def _queue_output(self, clid, data):
+        # the network thread applies the output limits when it gets them
+        self._outbox.append((clid, data))
+
+    def flush(self):
+        """Passes everything queued since the last flush to the network
+        thread to send. Call it once the game has finished a tick.
+        """
+        if self._outbox:
+            self._wake()
+
+    def get_disconnect(self, clid):
+        """Has the network thread send a client what we still had for
+        them, then disconnect them
+        """
+        self._outbox.append((clid, None))
+        self._wake()
+
+    def set_command_classes(self, classes, default=None):
+        # rate limits are applied on the network thread, which only ever
+        # sees the old mapping or the new one
+        self._io.set_command_classes(classes, default)
+
+    def get_stats(self):
+        """Returns a dictionary of counters describing the server, as
+        the network thread sees them
+        """
+        reply = queue.Queue()
+        self._outbox.append((None, reply))
+        self._wake()
+        return reply.get(timeout=5)
+
+    def shutdown(self):
+        """Stops the network thread, which disconnects all clients and
+        closes the listen socket.
+        """
+        self.flush()
+        self._stopping = True
+        self._wake()
+        self._thread.join()
+        self._wakeup.close()
+        self._waker.close()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+ File Name : ticker.py
+
+Fixed-timestep tick engine for the game loop. The loop is split into
+phases, e.g. network, commands and monster AI, and each one runs at a
+rate of its own, so the network can be looked at 20 times a second
+while monsters only think once a second.
+
+Every phase is timed. One that takes longer than its budget, which is
+its period unless given, counts as an overrun and is reported, and a
+phase that falls more than a whole period behind skips the ticks it
+missed instead of running them back to back.
+
+The ticker waits for the next phase with 'sleep'. A 'sleep' that can
+tell when input arrives, like a server's 'wait', returns true when it
+does, and the phases added with 'wake' then run straight away instead
+of on their next tick, so a command doesn't sit out the rest of one.
+
+While a tick runs, the ticker keeps note of when it started and which
+phase it is in, for a watchdog on another thread to look at.
+
+"""
+import time
+
+
+class _Phase():
+    """One step of the tick, and what we know about how it is doing"""
+
+    def __init__(self, name, callback, rate, deadline, budget, wake):
+        self.name = name
+        self.callback = callback
+        self.deadline = deadline
+        # whether it runs as soon as input arrives
+        self.wake = wake
+        self.period = 0
+        self.budget = budget
+        self.set_rate(rate)
+        # when the phase is next due to run
+        self.next_run = 0
+        # times it ran, and the seconds it took all told and at most
+        self.runs = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+        # runs that took longer than the budget
+        self.overruns = 0
+        # ticks skipped because the phase fell behind
+        self.skipped = 0
+
+    def set_rate(self, rate):
+        """Runs the phase 'rate' times a second from now on"""
+        if rate <= 0:
+            raise ValueError(f"rate of {self.name} must be positive")
+        self.period = 1 / rate
+
+    def due(self):
+        """When the phase next has something to do, or None if it is
+        waiting for its deadline and doesn't have one
+        """
+        if self.deadline is None:
+            return self.next_run
+        deadline = self.deadline()
+        if deadline is None:
+            return None
+        return max(self.next_run, deadline)
+
+
+class Ticker():
+    """Runs the phases of the game loop at their own rates.
+
+    Phases run in the order they were added, so a phase that relies on
+    another, e.g. commands on the network phase that read them, should
+    be added after it and at the same rate. A phase given a 'deadline'
+    function only runs once that time has come, on the first of its
+    ticks after it, which lets phases that are driven by the game's
+    timers sleep through the ticks where nothing is due.
+    """
+
+    def __init__(self, clock=time.time, sleep=time.sleep):
+        # the phases, in the order they run. They are scheduled by 'clock',
+        # and 'sleep' waits for the next one, returning true if it was cut
+        # short by input
+        self._phases = []
+        self._clock = clock
+        self._sleep = sleep
+        # when the tick in progress started, on the perf_counter clock, and
+        # the phase it is running, both None in between ticks. They are
+        # only ever replaced whole, so other threads can read them as is
+        self.tick_started = None
+        self.current_phase = None
+
+    def add_phase(self, name, callback, rate, deadline=None, budget=None,
+                  wake=False):
+        """Runs 'callback()' 'rate' times a second. 'deadline' returns
+        when the phase next has something to do, or None for nothing.
+        'budget' is how many seconds a run may take before it is an
+        overrun, the phase's period by default. With 'wake' it also runs
+        as soon as 'sleep' says input arrived.
+        """
+        if any(x.name == name for x in self._phases):
+            raise ValueError(f"there already is a phase called {name}")
+        phase = _Phase(name, callback, rate, deadline, budget, wake)
+        phase.next_run = self._clock()
+        self._phases.append(phase)
+
+    def set_rate(self, name, rate):
+        """Changes how many times a second phase 'name' runs"""
+        self._get_phase(name).set_rate(rate)
+
+    def _get_phase(self, name):
+        """Returns the phase called 'name'"""
+        for phase in self._phases:
+            if phase.name == name:
+                return phase
+        raise KeyError(name)
+
+    def next_deadline(self):
+        """When the next phase is due, or None if none of them are"""
+        return min((x for x in (phase.due() for phase in self._phases)
+                    if x is not None), default=None)
+
+    def run_due(self, now=None):
+        """Runs every phase that is due. Returns how many ran"""
+        if now is None:
+            now = self._clock()
+
+        count = 0
+        self.tick_started = time.perf_counter()
+        try:
+            for phase in self._phases:
+                if self._run_phase(phase, now):
+                    count += 1
+        finally:
+            self.current_phase = None
+            self.tick_started = None
+
+        return count
+
+    def _run_phase(self, phase, now):
+        """Runs 'phase' if it is due at 'now'. Returns whether it ran"""
+        due = phase.due()
+        if due is None or due > now:
+            return False
+
+        # the work itself is timed on the real clock, whatever clock the
+        # phases are scheduled by
+        self.current_phase = phase.name
+        started = time.perf_counter()
+        phase.callback()
+        elapsed = time.perf_counter() - started
+
+        phase.runs += 1
+        phase.seconds += elapsed
+        phase.slowest = max(phase.slowest, elapsed)
+        budget = phase.period if phase.budget is None else phase.budget
+        if elapsed > budget:
+            phase.overruns += 1
+            print(f"tick overrun: {phase.name} took "
+                  f"{elapsed * 1000:.1f}ms of its {budget * 1000:.1f}ms")
+
+        # stay on the fixed timestep, unless we're so far behind that
+        # catching up would mean running it again straight away
+        phase.next_run = max(phase.next_run, due) + phase.period
+        if phase.next_run <= now:
+            missed = int((now - phase.next_run) / phase.period) + 1
+            phase.skipped += missed
+            phase.next_run += missed * phase.period
+
+        return True
+
+    def run(self, stop=None):
+        """Runs the phases, sleeping in between, until 'stop()' returns
+        true. Without 'stop' it runs forever.
+        """
+        while stop is None or not stop():
+            self.run_due()
+
+            deadline = self.next_deadline()
+            if deadline is None:
+                # nothing is ever due, so there's nothing to wait for but
+                # whatever 'stop' is waiting on
+                deadline = self._clock() + 1
+            timeout = deadline - self._clock()
+            if timeout > 0 and self._sleep(timeout):
+                self.wake()
+
+    def wake(self):
+        """Makes the phases added with 'wake' due now"""
+        now = self._clock()
+        for phase in self._phases:
+            if phase.wake:
+                phase.next_run = min(phase.next_run, now)
+
+    def get_stats(self):
+        """Returns a dictionary of counters for each phase"""
+        return {
+            phase.name: {
+                "rate": 1 / phase.period,
+                "runs": phase.runs,
+                "seconds": phase.seconds,
+                "average": phase.seconds / phase.runs if phase.runs else 0.0,
+                "slowest": phase.slowest,
+                "overruns": phase.overruns,
+                "skipped": phase.skipped,
+            }
+            for phase in self._phases
+        }
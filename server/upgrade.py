@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+ File Name : upgrade.py
+
+Hands a running server over to a new copy of itself without dropping
+anyone. The old process starts the new one, passes it the listen socket
+and every client socket over a unix socket (SCM_RIGHTS), followed by
+whatever state the two agree on, and exits once the new process says it
+has taken over. Connections that arrive in between wait in the listen
+socket's queue.
+
+"""
+import pickle
+import socket
+import struct
+import subprocess
+
+# length of the pickled state and number of sockets that follow
+_HEADER = struct.Struct("!QI")
+# the kernel passes at most this many descriptors per message
+_MAX_FDS = 250
+# what the new process sends back once it is running
+_READY = b"R"
+
+
+def start_successor(argv, timeout=30):
+    """Starts 'argv' with '--resume-fd' and the descriptor of its end of
+    a unix socket added on. Returns our end of the socket and the new
+    process.
+    """
+    ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    process = subprocess.Popen(
+        argv + ["--resume-fd", str(theirs.fileno())],
+        pass_fds=[theirs.fileno()])
+    theirs.close()
+    ours.settimeout(timeout)
+    return ours, process
+
+
+def send_state(sock, state, sockets):
+    """Passes 'sockets' and the picklable 'state' down 'sock', then
+    waits for the other end to say it is ready. Returns whether it did.
+    """
+    blob = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    fds = [x.fileno() for x in sockets]
+
+    try:
+        sock.sendall(_HEADER.pack(len(blob), len(fds)))
+        for start in range(0, len(fds), _MAX_FDS):
+            socket.send_fds(sock, [b"F"], fds[start:start + _MAX_FDS])
+        sock.sendall(blob)
+        return _recv_exactly(sock, len(_READY)) == _READY
+    except (OSError, EOFError) as exc:
+        # it died or hung up before saying it was ready, e.g. while loading
+        # the state, which leaves us to carry on
+        print(f"handing over failed: {exc}")
+        return False
+
+
+def receive_state(sock):
+    """Returns the state and the sockets passed with 'send_state'"""
+    size, count = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+
+    # each message carries one byte of data along with its descriptors,
+    # so reading one byte at a time never runs into the next message
+    fds = []
+    while len(fds) < count:
+        _, received, _, _ = socket.recv_fds(sock, 1, _MAX_FDS)
+        if not received:
+            raise EOFError("predecessor went away")
+        fds.extend(received)
+
+    state = pickle.loads(_recv_exactly(sock, size))
+    return state, [socket.socket(fileno=fd) for fd in fds]
+
+
+def confirm(sock):
+    """Tells the old process we have taken over and it can go"""
+    sock.sendall(_READY)
+    sock.close()
+
+
+def _recv_exactly(sock, size):
+    """Reads exactly 'size' bytes from a blocking socket"""
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError("connection closed")
+        data += chunk
+    return bytes(data)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+ File Name : watchdog.py
+
+Watchdog for the game loop. A thread of its own keeps an eye on the
+ticker, and when a tick has been going for longer than its budget it
+prints what the game thread is doing right then: the phase the tick is
+in and the Python stack of the game thread, taken from
+sys._current_frames. A tick that stalls now and then, e.g. on a lair
+respawning a big group of monsters, can then be tracked down from the
+log without a profiler attached.
+
+The watchdog only reads what the ticker publishes and never stops the
+game, so a slow tick is reported while it is still going and carries
+on once it's done.
+
+"""
+import sys
+import threading
+import time
+import traceback
+
+
+class Watchdog():
+    """Reports ticks of 'ticker' that take longer than 'budget' seconds.
+
+    Create it on the thread running the ticker, or pass that thread's
+    ident as 'thread', then 'start' it. Each slow tick is reported once,
+    when it passes its budget, and how long it took all told is reported
+    when it's done.
+    """
+
+    def __init__(self, ticker, budget, interval=None, thread=None):
+        if budget <= 0:
+            raise ValueError("watchdog budget must be positive")
+        self._ticker = ticker
+        self._budget = budget
+        # how often to look at the ticker. Often enough to catch a tick
+        # not long after it passed its budget
+        self._interval = budget / 4 if interval is None else interval
+        # the thread whose stack we print
+        self._thread = threading.get_ident() if thread is None else thread
+        self._stop = threading.Event()
+        self._watcher = None
+        # the tick reported last, by when it started, and the phase it was
+        # in at the time
+        self._reported = None
+        self._reported_phase = None
+        # slow ticks seen so far
+        self.stalls = 0
+
+    def start(self):
+        """Starts watching"""
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._run, name="watchdog",
+                                         daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        """Stops watching, and waits for the watcher to be done"""
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def _run(self):
+        """The watcher thread"""
+        while not self._stop.wait(self._interval):
+            self.check()
+
+    def check(self):
+        """Looks at the ticker once, reporting a tick that is too slow"""
+        # read each of them once, as the game thread changes them under us
+        started = self._ticker.tick_started
+        phase = self._ticker.current_phase
+
+        if self._reported is not None and started != self._reported:
+            # the slow tick we reported is over. We look every 'interval',
+            # so it took up to that much less than this
+            took = time.perf_counter() - self._reported
+            print(f"tick watchdog: the tick stuck in "
+                  f"{self._reported_phase or 'between phases'} finished "
+                  f"after about {took * 1000:.0f}ms")
+            self._reported = None
+
+        if started is None or started == self._reported:
+            return
+        elapsed = time.perf_counter() - started
+        if elapsed <= self._budget:
+            return
+
+        self.stalls += 1
+        self._reported = started
+        self._reported_phase = phase
+        frame = sys._current_frames().get(self._thread)
+        stack = "".join(traceback.format_stack(frame)) if frame else \
+            "  (the game thread is gone)\n"
+        print(f"tick watchdog: tick running for {elapsed * 1000:.0f}ms, "
+              f"over its {self._budget * 1000:.0f}ms budget, in "
+              f"{phase or 'between phases'}. The game thread is at:\n"
+              f"{stack}", end="")
@@ -91,9 +91,13 @@ Feature Requests:
 author: Mark Frimston - mfrimston@gmail.com
 """
 
-import random
+import argparse
+import asyncio
+import signal
+import socket
 import sys
 import time
+from collections import deque
 
 # import library objects
 from lib.monster import Monster
@@ -105,14 +109,26 @@ from lib.species import Species
 from lib.monsterstats import MonsterStats
 from lib.magic import Magic
 from lib.dungeon import Dungeon
-from lib.dice import Dice
+from lib.sim import Sim, TickClock, VirtualClock
 from lib.key import Key
 from lib.door import Door
 from lib.condition import Condition
 from lib.trap import Trap
+from lib.scheduler import Scheduler
+from lib.command import Commands
+from lib.events import (EventBus, TextRenderer, PlayerEntered, PlayerQuit,
+                        PlayerMoved, PlayerSaid, MonsterAppeared,
+                        DamageDealt)
 
 # import the MUD server class
 from server.mud import Mud
+from server.async_mud import AsyncMud
+from server.gateway import GatewayMud
+from server.threaded_mud import ThreadedMud
+from server.ticker import Ticker
+from server.watchdog import Watchdog
+from server.replay import ReplayMud
+from server import replay, upgrade
 
 
 class Game():
@@ -120,10 +136,16 @@ class Game():
     This class contains all of the functions to allow the game to operate
     """
 
-    def __init__(self, mud):
-        # start the server
+    def __init__(self, mud, actions_per_round=1, max_actions_per_tick=None,
+                 max_queued_actions=20, sim=None, render=True):
+        # the clock and the random numbers. A seeded one with a virtual clock
+        # plays out the same way every time
+        self._sim = sim or Sim()
+        self._now = self._sim.time
+        self._combat = self._sim.stream("combat")
+        self._spawning = self._sim.stream("spawning")
 
-        self._trap = Trap()
+        self._trap = Trap(self._sim)
 
         self._monster = Monster()
 
@@ -133,7 +155,7 @@ class Game():
 
         self._weapon = Weapon()
 
-        self._class = Classes()
+        self._class = Classes(self._sim)
 
         self._species = Species()
 
@@ -143,9 +165,9 @@ class Game():
 
         self._dungeon = Dungeon()
 
-        self._dice = Dice()
+        self._dice = self._sim.dice("combat")
 
-        self._condition = Condition()
+        self._condition = Condition(self._sim)
 
         self._grid = self._dungeon.grid  # town
 
@@ -173,6 +195,23 @@ class Game():
 
         self._mud = mud
 
+        # what players see others do goes out as events, which are only
+        # turned into text for players with a renderer. Without one nobody
+        # is told, and nothing is rendered. Whatever a player is told about
+        # their own doing, what they hit, killed or found, is sent to them
+        # straight away, renderer or not
+        self._events = EventBus(mud)
+        self._renderer = TextRenderer() if render else None
+
+        # everything players can type, and the server told what kind of
+        # command each one is, so that nobody can run too many of one kind
+        # at once. Anything else players type is said out loud, so it
+        # counts as chat
+        self._commands = Commands()
+        self._add_commands()
+        self._mud.set_command_classes(self._commands.rate_classes(),
+                                      default="chat")
+
         self._players = {}
 
         self._monsters = {}
@@ -190,6 +229,33 @@ class Game():
         # counter for assigning each client a new id
         self._nextid = 0
 
+        # timers for everything that happens without player input. Lairs,
+        # monsters and players each get their own, so that every pass of
+        # the game loop only looks at what is actually due
+        self._lair_timers = Scheduler(self._now)
+        self._monster_timers = Scheduler(self._now)
+        self._status_timers = Scheduler(self._now)
+
+        # how long a monster that didn't get to attack waits before trying
+        # again, e.g. when it picked a friend to fight
+        self._monster_retry = 1
+
+        # commands each player sent that haven't run yet, oldest first, and
+        # the players that have some, in the order they get their turn. Every
+        # round each player runs up to 'actions_per_round' of theirs, and no
+        # more than 'max_actions_per_tick' run in all. A player may have
+        # up to 'max_queued_actions' waiting, anything past that is thrown
+        # away, and the players it happened to are told once until their
+        # queue moves again
+        self._queues = {}
+        self._turns = deque()
+        self._actions_per_round = actions_per_round
+        self._max_actions_per_tick = max_actions_per_tick
+        self._max_queued_actions = max_queued_actions
+        self._overflowed = set()
+
+        self._arm_timers()
+
     @staticmethod
     def _rdiv(num, div):
         """
@@ -359,7 +425,7 @@ class Game():
                     and wtype[2] in weapon["modifier"]:
                 weapon_of_choice.append(weapon)
 
-        return random.choice(weapon_of_choice)
+        return self._spawning.choice(weapon_of_choice)
 
     def _get_monster_armor(self, uid):
         """determine ac"""
@@ -375,7 +441,7 @@ class Game():
         for armor in self._armors:
             if atype in armor["size"]:
                 armor_of_choice.append(armor)
-        return random.choice(armor_of_choice)
+        return self._spawning.choice(armor_of_choice)
 
     def _monster_room(self, room):
         """ wheres that monster """
@@ -717,17 +783,20 @@ class Game():
 
     def _process_help_command(self, uid):
         """
-        write out the room and any players or items in it
+        write out the commands players can use
         """
+        # players still making their character can only use the commands
+        # that don't need one
+        making = self._players[uid]["class"] is None
+        shown = [x for x in self._commands
+                 if x.summary and not (making and x.needs_player)]
+        width = max(len(x.usage) for x in shown) + 2
+
         self._mud.send_message(uid, "Commands:")
-        self._mud.send_message(
-            uid, "  say <message>  - Says something out loud.")
-        self._mud.send_message(
-            uid, "  look           - Examines the surroundings")
-        self._mud.send_message(
-            uid, "  go <exit>      - Moves through the exit specified.")
-        self._mud.send_message(
-            uid, "  quit           - Quits the game.")
+        for command in shown:
+            tiring = " Tires you out." if command.fatigue else ""
+            self._mud.send_message(
+                uid, f"  {command.usage:<{width}}- {command.summary}{tiring}")
 
     def _process_new_player(self, uid, command):
         """
@@ -736,7 +805,7 @@ class Game():
         self._players[uid]["class"] = command
         self._players[uid]["rune"] = "None"
         self._players[uid]["room"] = [1, 4, 2]
-        self._players[uid]["fatigue"] = time.time()
+        self._players[uid]["fatigue"] = self._now()
         self._players[uid]["hit_dice"] = self._classes[command]["hit_dice"]
         self._players[uid]["level"] = 1
         self._players[uid]["strength"] = self._get_stat(uid, "strength")
@@ -747,7 +816,7 @@ class Game():
         self._players[uid]["charisma"] = self._get_stat(uid, "charisma")
         self._players[uid]["max_hp"] = self._max_hp(uid)
         self._players[uid]["current_hp"] = self._max_hp(uid)
-        self._players[uid]["regen_hp"] = time.time()
+        self._players[uid]["regen_hp"] = self._now()
         self._players[uid]["max_mp"] = 0
         self._players[uid]["current_mp"] = 0
         self._players[uid]["max_enc"] = self._max_enc(uid)
@@ -770,15 +839,13 @@ class Game():
         self._players[uid]["inventory"] = []
         self._players[uid]["spellbook"] = []
         self._players[uid]["coins"] = (
-            self._roll_dice(self._classes[command]["wealth"])
+            self._sim.dice("character").roll(
+                self._classes[command]["wealth"])
         )
 
-        # go through all the players in the game
-        for pid, _ in self._players.items():
-            # send each player a message to tell them about the new player
-            if pid != uid:
-                self._mud.send_message(pid, "{} entered the game".format(
-                    self._players[uid]["name"]))
+        # tell all the other players about the new player
+        self._events.emit(PlayerEntered(self._players[uid]["name"]),
+                          observer=self._everyone(exclude=uid))
 
         # send the new player a welcome message
         self._mud.send_message(uid, "Welcome to the game, {}. ".format(
@@ -787,26 +854,33 @@ class Game():
         # send the new player the description of their current room
         self._process_look_command(uid)
 
+        # and whatever is waiting there a chance to greet them
+        self._wake_monsters([1, 4, 2])
+
     def _process_unknown_command(self, uid, command, params):
         """
         say stuff to other folks
         """
-        for pid, player in self._players.items():
-            # if they're in the same room as the player
-            if player["room"] == self._players[uid]["room"] \
-                    and pid != uid:
-                # send them a message telling them what the player said
-                self._mud.send_message(
-                    pid, (
-                        "{} says: {}".format(
-                            self._players[uid]["name"],
-                            " ".join([command, params])
-                        )
-                    )
-                )
-                self._mud.send_message(uid, "--- Message Sent ---")
+        return self._process_say_command(uid, " ".join([command, params]))
 
-                return True
+    def _process_say_command(self, uid, message):
+        """
+        say stuff to other folks
+        """
+        # everyone else in the same room as the player
+        listeners = [
+            pid for pid, player in self._players.items()
+            if player["room"] == self._players[uid]["room"] and pid != uid
+        ]
+
+        if listeners:
+            # tell them what the player said
+            self._events.emit(
+                PlayerSaid(self._players[uid]["name"], message),
+                observer=listeners)
+            self._mud.send_message(uid, "--- Message Sent ---")
+
+            return True
 
         self._mud.send_message(
             uid, "Sorry, that is not an appropriate command.")
@@ -817,8 +891,12 @@ class Game():
         """
         exit on your own terms
         """
-        self._mud.send_message(uid, "Goodbye, {}.".format(
-            self._players[uid]["name"]))
+        # they may quit before they've even told us their name
+        name = self._players[uid]["name"]
+        if name is None:
+            self._mud.send_message(uid, "Goodbye.")
+        else:
+            self._mud.send_message(uid, "Goodbye, {}.".format(name))
         self._mud.get_disconnect(uid)
 
     def _process_unequip_command(self, uid, params):
@@ -931,7 +1009,7 @@ class Game():
         if self._players[uid]["class"] is None:
             return
 
-        if time.time() - self._players[uid]["fatigue"] < self._tick:
+        if self._now() - self._players[uid]["fatigue"] < self._tick:
             self._players[uid]["status"] = "Fatigued"
         else:
             self._players[uid]["status"] = "Healthy"
@@ -944,9 +1022,10 @@ class Game():
             return
 
         # regen_hp
-        if time.time() - self._players[uid]["regen_hp"] > self._tick:
-            self._players[uid]["current_hp"] += self._roll_dice([1, 4])
-            self._players[uid]["regen_hp"] = time.time()
+        if self._now() - self._players[uid]["regen_hp"] >= self._tick:
+            self._players[uid]["current_hp"] += (
+                self._sim.dice("status").roll([1, 4]))
+            self._players[uid]["regen_hp"] = self._now()
             if self._players[uid]["current_hp"] > self._players[uid]["max_hp"]:
                 self._players[uid]["current_hp"] = self._players[uid]["max_hp"]
 
@@ -1026,7 +1105,7 @@ class Game():
     def _process_go_command(self, uid, command, params):
         """ move around """
         if 'fatigued' in self._condition.get_status(self._players[uid]).lower():
-            # if time.time() - self._players[uid]["fatigue"] < self._tick:
+            # if self._now() - self._players[uid]["fatigue"] < self._tick:
             self._mud.send_message(
                 uid, (
                     "Sorry, you'll have to rest a while before you can move."
@@ -1115,33 +1194,19 @@ class Game():
             # move player to next room
             self._players[uid]["room"] = next_player_room
 
-            # go through all the players in the game
-            for pid, player in self._players.items():
-                # if player is in the same room and isn't the player
-                # sending the command
-                if player["room"] == self._players[uid]["room"] \
-                        and pid != uid:
-                    # send them a message telling them that the player
-                    # left the room
-                    self._mud.send_message(
-                        pid, "{} just left to the {}.".format(
-                            self._players[uid]["name"], door))
-
-            # go through all the players in the game
-            for pid, player in self._players.items():
-                # if player is in the same (new) room and isn't the player
-                # sending the command
-                if player["room"] == self._players[uid]["room"] \
-                        and pid != uid:
-                    # send them a message telling them that the player
-                    # entered the room
-                    self._mud.send_message(
-                        pid, "{} just arrived from the {}.".format(
-                            self._players[uid]["name"], door))
+            # tell the players in the old room that the player left, and
+            # the players in the new room that they arrived
+            self._events.emit(
+                PlayerMoved(self._players[uid]["name"], door),
+                origin=self._everyone_in(cur_player_room, exclude=uid),
+                destination=self._everyone_in(next_player_room, exclude=uid))
 
             # send the player a message telling them where they are now
             self._process_look_command(uid)
 
+            # anything in there gets to have a go at them
+            self._wake_monsters(next_player_room)
+
         # the specified exit wasn't found in the current room
         else:
             # send back an 'unknown exit' message
@@ -1182,7 +1247,7 @@ class Game():
                 monsters_here.update({hmid: hmonster})
 
         if monsters_here:
-            mid, monster = random.choice(list(monsters_here.items()))
+            mid, monster = self._combat.choice(list(monsters_here.items()))
             if 'fatigued' not in \
                     self._condition.get_status(self._players[uid]).lower():
                 damage = 0
@@ -1215,7 +1280,8 @@ class Game():
 
                     # set the clock to respawn monsters if this is a lair
                     if "spawn_timer" in cur_room.keys():
-                        cur_room["spawn_timer"] = time.time()
+                        cur_room["spawn_timer"] = self._now()
+                        self._arm_lair(monster["room"])
 
                     # check for loot
                     if "loot" in cur_room.keys():
@@ -1296,7 +1362,7 @@ class Game():
         damage = self._roll_dice(spell["effect"])
 
         player["conditions"].append(self._condition.set_condition("fatigued"))
-        # player["fatigue"] = time.time()
+        # player["fatigue"] = self._now()
         player["xp"] += xp_incr * damage
         self._mud.send_message(
             uid, spell["description"].format(target["name"], damage))
@@ -1326,7 +1392,7 @@ class Game():
 
             damage = dice + self._get_modifier(player["strength"])
 
-            # player["fatigue"] = time.time()
+            # player["fatigue"] = self._now()
             if player["current_attacks"] == 1:
                 player["conditions"].append(
                     self._condition.set_condition("fatigued"))
@@ -1354,7 +1420,7 @@ class Game():
                 player["current_attacks"] = player["attacks"]
             else:
                 player["current_attacks"] -= 1
-            # self._players[uid]["fatigue"] = time.time()
+            # self._players[uid]["fatigue"] = self._now()
 
     def _process_spell_heal(self, uid, spell, target):
         """
@@ -1425,7 +1491,8 @@ class Game():
         print([monster["room"] for num, monster in self._monsters.items()])
         if not mob:
             self._monsters[self._nextid] = (
-                random.choice([x for x in self._mm if x["cr"] < 2]).copy()
+                self._spawning.choice(
+                    [x for x in self._mm if x["cr"] < 2]).copy()
             )
         else:
             self._monsters[self._nextid] = self._mm[mob].copy()
@@ -1437,7 +1504,7 @@ class Game():
         self._monsters[self._nextid]["hit_dice"] = (
             self._monsterstats[self._monsters[self._nextid]["cr"]]["hit_dice"]
         )
-        self._monsters[self._nextid]["fatigue"] = time.time()
+        self._monsters[self._nextid]["fatigue"] = self._now()
         self._monsters[self._nextid]["strength"] = (
             self._monsterstats[self._monsters[self._nextid]["cr"]]["strength"]
         )
@@ -1467,10 +1534,10 @@ class Game():
         self._monsters[self._nextid]["armor_class"] = (
             self._monster_armor_class(self._nextid)
         )
-        self._monsters[self._nextid]["regen_hp"] = time.time()
+        self._monsters[self._nextid]["regen_hp"] = self._now()
         self._monsters[self._nextid]["armor_class"] = (
             self._monster_armor_class(self._nextid))
-        self._monsters[self._nextid]["coins"] = self._roll_dice(
+        self._monsters[self._nextid]["coins"] = self._sim.dice("loot").roll(
             self._monsterstats[self._monsters[self._nextid]["cr"]]["wealth"])
         print(
             "spawned {} with cr {} that has {} xp in {}.".format(
@@ -1483,17 +1550,15 @@ class Game():
         print([monster["room"] for num, monster in self._monsters.items()])
         print()
 
-        for pid, player in self._players.items():
-            if self._monsters[self._nextid]["room"] == player["room"]:
-                self._mud.send_message(
-                    pid, (
-                        "A {} just appeared in a blinding flash of "
-                        "light.".format(self._monsters[self._nextid]["name"])
-                    )
-                )
+        self._events.emit(
+            MonsterAppeared(self._monsters[self._nextid]["name"]),
+            observer=self._everyone_in(self._monsters[self._nextid]["room"]))
 
         self._nextid += 1
 
+        # it may have appeared right next to someone
+        self._wake_monsters(room)
+
     def _monsters_move(self):
         """
         if monsters aren't tethered to a lair, move them around
@@ -1523,9 +1588,9 @@ class Game():
                 monsters_here.update({tid: target})
 
         if players_here:
-            pid, player = random.choice(list(players_here.items()))
+            pid, player = self._combat.choice(list(players_here.items()))
 
-            if time.time() - monster["fatigue"] > self._tick:
+            if self._now() - monster["fatigue"] >= self._tick:
 
                 attack = (
                     self._roll_dice([1, 20])
@@ -1552,17 +1617,11 @@ class Game():
                                 monster["equipped"]["weapon"]["type"],
                                 damage))
                             )
-                    for uid, _ in self._players.items():
-                        if uid != pid:
-                            self._mud.send_message(
-                                uid, (
-                                    "The {} attacked {} with their {}!".format(
-                                        monster["name"],
-                                        player["name"],
-                                        monster["equipped"]["weapon"]["type"]
-                                    )
-                                )
-                            )
+                    self._events.emit(
+                        DamageDealt(monster["name"], player["name"],
+                                    monster["equipped"]["weapon"]["type"],
+                                    damage),
+                        observer=self._everyone(exclude=pid))
                     player["current_hp"] -= damage
                     if player["current_hp"] < 1:
                         self._mud.send_message(pid, (
@@ -1574,8 +1633,9 @@ class Game():
                         self._players[pid]["room"] = [1, 4, 2]
                         self._players[pid]["current_hp"] = 1
                         self._process_look_command(pid)
+                        self._wake_monsters([1, 4, 2])
                     # del self._monsters[mid]
-                    self._monsters[mid]["fatigue"] = time.time()
+                    self._monsters[mid]["fatigue"] = self._now()
                 else:
                     self._mud.send_message(
                         pid, (
@@ -1583,16 +1643,16 @@ class Game():
                             "you.".format(monster["name"])
                         )
                     )
-                    self._monsters[mid]["fatigue"] = time.time()
+                    self._monsters[mid]["fatigue"] = self._now()
         else:
             if not monsters_here:
                 return False
 
-            pid, player = random.choice(list(monsters_here.items()))
+            pid, player = self._combat.choice(list(monsters_here.items()))
             if player["name"].split(" ")[-1] == monster["name"].split(" ")[-1]:
                 return False
 
-            if time.time() - monster["fatigue"] > self._tick:
+            if self._now() - monster["fatigue"] >= self._tick:
 
                 attack = (
                     self._roll_dice([1, 20])
@@ -1649,9 +1709,10 @@ class Game():
                                     )
 
                         del self._monsters[pid]
-                    monster["fatigue"] = time.time()
+                        self._arm_lair(player["room"])
+                    monster["fatigue"] = self._now()
                 else:
-                    monster["fatigue"] = time.time()
+                    monster["fatigue"] = self._now()
 
     def _process_list_command(self, uid):
         """ list items if that room has them """
@@ -1967,348 +2028,987 @@ class Game():
                 self._mud.send_message(
                     uid, f"This shop doesn't offer {params}.")
 
-    def check_for_new_players(self):
+    def new_player(self, pid):
         """
-        check to see if any new connections arrived since last update
+        handle a player that just connected
         """
-        # go through any newly connected players
-        for pid in self._mud.get_new_players():
+        # add the new player to the dictionary, noting that they've not
+        # named yet.
+        # The dictionary key is the player's id number. We set their room
+        # None initially until they have entered a name
+        # Try adding more player stats - level, gold, inventory, etc
+        self._players[pid] = {
+            "name": None,
+            "species": None,
+            "class": None,
+            "room": None
+        }
 
-            # add the new player to the dictionary, noting that they've not
-            # named yet.
-            # The dictionary key is the player's id number. We set their room
-            # None initially until they have entered a name
-            # Try adding more player stats - level, gold, inventory, etc
-            self._players[pid] = {
-                "name": None,
-                "species": None,
-                "class": None,
-                "room": None
-            }
-
-            # send the new player a prompt for their name
-            self._mud.send_message(pid, "What is your name?")
+        # they hear about what everyone else is up to
+        if self._renderer is not None:
+            self._events.subscribe(pid, self._renderer)
 
-    def check_for_disconnected_players(self):
+        # send the new player a prompt for their name
+        self._mud.send_message(pid, "What is your name?")
+
+    def player_left(self, uid):
         """
-        check to see if anyone disconnected since last update
+        handle a player that just disconnected
         """
-        for uid in self._mud.get_disconnected_players():
+        # if for any reason the player isn't in the player map, skip them
+        if uid not in self._players:
+            return
 
-            # if for any reason the player isn't in the player map, skip them
-            # move on to the next one
-            if uid not in self._players:
-                continue
+        # nothing more happens to them
+        self._status_timers.cancel(uid)
+        self._queues.pop(uid, None)
+        self._overflowed.discard(uid)
 
-            # go through all the players in the game
-            for pid, _ in self._players.items():
-                # send each player a message to tell them about the diconnected
-                # player
-                if pid != uid:
-                    self._mud.send_message(pid, "{} quit the game".format(
-                        self._players[uid]["name"]))
+        # tell all the other players about the disconnected player
+        self._events.unsubscribe(uid)
+        self._events.emit(PlayerQuit(self._players[uid]["name"]),
+                          observer=self._everyone(exclude=uid))
+        self._events.flush()
 
-            # remove the player's entry in the player dictionary
-            del self._players[uid]
+        # remove the player's entry in the player dictionary
+        del self._players[uid]
 
-    def check_for_new_commands(self):
+    def new_command(self, uid, command, params):
         """
-        check to see if any new commands are on the queue
+        handle a command sent by a player. It waits in their queue until
+        run_commands gets to it
         """
-        for uid, command, params in self._mud.get_commands():
-
-            # if for any reason the player isn't in the player map, skip them
-            # move on to the next one
-            if uid not in self._players:
-                continue
-
-            # if the player hasn't given their name yet, use this first command
-            # their name and move them to the starting room.
-            if self._players[uid]["name"] is None:
+        # if for any reason the player isn't in the player map, skip them
+        if uid not in self._players:
+            return
 
-                self._players[uid]["name"] = command.capitalize()
+        queue = self._queues.get(uid)
+        if queue is None:
+            queue = self._queues[uid] = deque()
+            self._turns.append(uid)
 
-                self._mud.send_message(uid, "")
-                self._mud.send_message(uid, "+==========+============+")
-                self._mud.send_message(uid, "| Num      | Species    |")
-                self._mud.send_message(uid, "+----------+------------+")
-                for num, species in enumerate(self._species):
-                    self._mud.send_message(
-                        uid, (
-                            f"| {num:<9}"
-                            f"| {species['type']:11}|"
-                        )
-                    )
-                self._mud.send_message(uid, "+==========+============+")
-                self._mud.send_message(uid, "")
-                self._mud.send_message(uid, "What species are you?")
+        # they're sending a lot faster than their commands run
+        if len(queue) >= self._max_queued_actions:
+            if uid not in self._overflowed:
+                self._overflowed.add(uid)
+                self._mud.send_message(
+                    uid, "You're already busy, slow down a little.")
+            return
+        queue.append((command, params))
 
-            elif self._players[uid]["species"] is None:
+    def queued_commands(self):
+        """
+        number of commands waiting for run_commands
+        """
+        return sum(len(queue) for queue in self._queues.values())
 
-                self._players[uid]["species"] = int(command)
+    def run_commands(self):
+        """
+        run a round of the queued commands, each player in turn running
+        the oldest of theirs, so that everyone gets a go however much
+        somebody else sends. A round cut short by the limit per tick
+        carries on where it stopped next time
+        """
+        budget = self._max_actions_per_tick
+        for _ in range(len(self._turns)):
+            if budget is not None and budget <= 0:
+                break
 
-                self._mud.send_message(uid, "")
-                self._mud.send_message(uid, "+==========+============+")
-                self._mud.send_message(uid, "| Num      | Class      |")
-                self._mud.send_message(uid, "+----------+------------+")
-                for num, classes in enumerate(self._classes):
-                    self._mud.send_message(
-                        uid, (
-                            f"| {num:<9}"
-                            f"| {classes['type']:11}|"
-                        )
-                    )
-                self._mud.send_message(uid, "+==========+============+")
-                self._mud.send_message(uid, "")
-                self._mud.send_message(uid, "What class are you?")
+            uid = self._turns.popleft()
+            queue = self._queues.get(uid)
+            if queue is None:
+                # they left
+                continue
 
-            elif self._players[uid]["class"] is None:
+            actions = self._actions_per_round
+            if budget is not None:
+                actions = min(actions, budget)
+            self._overflowed.discard(uid)
+            for _ in range(min(actions, len(queue))):
+                command, params = queue.popleft()
+                self._run_command(uid, command, params)
+                if budget is not None:
+                    budget -= 1
+                if uid not in self._players:
+                    break
 
-                self._process_new_player(uid, int(command))
+            if queue and uid in self._players:
+                self._turns.append(uid)
+            elif self._queues.get(uid) is queue:
+                del self._queues[uid]
 
-            # 'help' command
-            elif command == "help":
+    def _run_command(self, uid, command, params):
+        """
+        run a command a player queued
+        """
+        self._process_command(uid, command, params)
 
-                # send the player back the list of possible commands
-                self._process_help_command(uid)
+        # what others saw them do goes out before the next command, so that
+        # everyone hears about things in the order they happened
+        self._events.flush()
 
-            # 'say' command
-            elif command == "say":
-                pass
-                # go through every player in the game
-                # self._process_say_command(uid, params)
+        # the command may have changed when their conditions next come and
+        # go, e.g. by eating or starting a fight
+        if uid in self._players:
+            self._arm_status(uid)
 
-            # 'look' command
-            elif command in ["look", "l"]:
+    def _process_command(self, uid, command, params):
+        """
+        run a command for a player that is in the game
+        """
+        # players making their character may still use the commands that
+        # don't need one, as long as they type them out
+        if self._players[uid]["class"] is None:
+            found = self._commands.find(command, abbreviations=False)
+            if found is not None and not found.needs_player:
+                self._commands.run(uid, command, params)
+            else:
+                self._create_character(uid, command)
+            return
 
-                # look around to see who and what is around
-                if params == "":
-                    self._process_long_look_command(uid)
-                else:
-                    self._process_look_at_command(uid, params)
+        if not self._commands.run(uid, command, params):
+            # some other, unrecognised command
+            self._process_unknown_command(uid, command, params)
 
-            # 'look' command
-            elif command in [""]:
+    def _create_character(self, uid, command):
+        """
+        take a new player through picking their name, species and class
+        """
+        # if the player hasn't given their name yet, use this first command
+        # their name and move them to the starting room.
+        if self._players[uid]["name"] is None:
 
-                # look around to see who and what is around
-                self._process_look_command(uid)
+            self._players[uid]["name"] = command.capitalize()
 
-            elif command in ["eat"]:
+            self._mud.send_message(uid, "")
+            self._mud.send_message(uid, "+==========+============+")
+            self._mud.send_message(uid, "| Num      | Species    |")
+            self._mud.send_message(uid, "+----------+------------+")
+            for num, species in enumerate(self._species):
+                self._mud.send_message(
+                    uid, (
+                        f"| {num:<9}"
+                        f"| {species['type']:11}|"
+                    )
+                )
+            self._mud.send_message(uid, "+==========+============+")
+            self._mud.send_message(uid, "")
+            self._mud.send_message(uid, "What species are you?")
 
-                # look around to see who and what is around
-                self._process_eat_command(uid, params)
+        elif self._players[uid]["species"] is None:
 
-            elif command in ["drink"]:
+            self._players[uid]["species"] = int(command)
 
-                # look around to see who and what is around
-                self._process_drink_command(uid, params)
+            self._mud.send_message(uid, "")
+            self._mud.send_message(uid, "+==========+============+")
+            self._mud.send_message(uid, "| Num      | Class      |")
+            self._mud.send_message(uid, "+----------+------------+")
+            for num, classes in enumerate(self._classes):
+                self._mud.send_message(
+                    uid, (
+                        f"| {num:<9}"
+                        f"| {classes['type']:11}|"
+                    )
+                )
+            self._mud.send_message(uid, "+==========+============+")
+            self._mud.send_message(uid, "")
+            self._mud.send_message(uid, "What class are you?")
+
+        elif self._players[uid]["class"] is None:
+
+            self._process_new_player(uid, int(command))
+
+    def _add_commands(self):
+        """
+        register everything players can type
+        """
+        add = self._commands.add
+        add("help", lambda uid, command, params:
+            self._process_help_command(uid),
+            summary="Shows this list.", rate_class="info",
+            needs_player=False)
+        add("say", lambda uid, command, params:
+            self._process_say_command(uid, params),
+            usage="say <message>", summary="Says something out loud.",
+            rate_class="chat")
+        add("look", self._process_look_or_look_at, aliases=["l"],
+            usage="look [thing]",
+            summary="Examines the surroundings, or something in them.",
+            rate_class="info")
+        add("", lambda uid, command, params:
+            self._process_look_command(uid), rate_class="info")
+        add("go", self._process_go_command, usage="go <exit>",
+            summary="Moves through the exit specified.",
+            rate_class="movement", fatigue=True)
+        for direction in ["north", "south", "east", "west", "up", "down"]:
+            add(direction, self._process_go_command, rate_class="movement",
+                fatigue=True)
+        add("attack", lambda uid, command, params:
+            self._process_attack_command(uid, params), aliases=["a"],
+            usage="attack <monster>", summary="Attacks a monster.",
+            rate_class="combat", fatigue=True)
+        add("cast", lambda uid, command, params:
+            self._process_cast_command(uid, params),
+            usage="cast <spell> [target]", summary="Casts a spell.",
+            rate_class="combat", fatigue=True)
+        add("ring", self._process_ring_command, aliases=["r"],
+            usage="ring gong", summary="Calls up a monster to fight.",
+            rate_class="combat")
+        add("experience", lambda uid, command, params:
+            self._process_experience_command(uid), aliases=["xp"],
+            summary="Shows your experience.", rate_class="info")
+        add("stats", lambda uid, command, params:
+            self._process_stats_command(uid), aliases=["st"],
+            summary="Shows your character.", rate_class="info")
+        add("health", lambda uid, command, params:
+            self._process_health_command(uid), aliases=["hp"],
+            summary="Shows your health.", rate_class="info",
+            min_abbreviation=5)
+        add("inv", lambda uid, command, params:
+            self._process_inv_command(uid),
+            summary="Shows what you are carrying.", rate_class="info")
+        add("eat", lambda uid, command, params:
+            self._process_eat_command(uid, params),
+            usage="eat <food>", summary="Eats something.",
+            rate_class="items")
+        add("drink", lambda uid, command, params:
+            self._process_drink_command(uid, params),
+            usage="drink <drink>", summary="Drinks something.",
+            rate_class="items")
+        add("list", self._process_list_or_list_at, usage="list [item]",
+            summary="Shows what the shop here sells.", rate_class="info")
+        add("buy", self._process_buy_or_train, usage="buy <item>",
+            summary="Buys something from the shop here.",
+            rate_class="items")
+        add("sell", lambda uid, command, params:
+            self._process_sell_command(uid, params),
+            usage="sell <item>", summary="Sells something to the shop here.",
+            rate_class="items")
+        add("equip", lambda uid, command, params:
+            self._process_equip_command(uid, params),
+            usage="equip <item>", summary="Wields or wears something.",
+            rate_class="items")
+        add("drop", lambda uid, command, params:
+            self._process_drop_command(uid, params),
+            usage="drop <item>", summary="Drops something on the floor.",
+            rate_class="items")
+        add("get", lambda uid, command, params:
+            self._process_get_command(uid, params),
+            usage="get <item>", summary="Picks something up off the floor.",
+            rate_class="items")
+        add("learn", lambda uid, command, params:
+            self._process_learn_command(uid, params),
+            usage="learn <spell>", summary="Learns a spell.",
+            rate_class="items")
+        add("quit", lambda uid, command, params:
+            self._process_quit_command(uid),
+            summary="Quits the game.", rate_class="info", needs_player=False,
+            abbreviate=False)
+
+    def _process_look_or_look_at(self, uid, command, params):
+        """
+        look around to see who and what is around
+        """
+        if params == "":
+            self._process_long_look_command(uid)
+        else:
+            self._process_look_at_command(uid, params)
 
-            # 'go' command
-            elif command in ["go", "east", "west", "north", "south", "up", "down"]:
+    def _process_ring_command(self, uid, command, params):
+        """
+        there's only the gong to ring, anything else is just talk
+        """
+        if params in ["gong", "g"]:
+            self._process_ring_gong(uid)
+        else:
+            self._process_unknown_command(uid, command, params)
 
-                # go to another rooms
-                self._process_go_command(uid, command, params)
+    def _process_list_or_list_at(self, uid, command, params):
+        """
+        list the shop's wares, or the details of one
+        """
+        if params:
+            self._process_list_at_command(uid, params)
+        else:
+            self._process_list_command(uid)
 
-            # "attack" command
-            elif command in ["attack", "a"]:
+    def _process_buy_or_train(self, uid, command, params):
+        """
+        buy something, training included
+        """
+        if "training" in params:
+            self._process_train_command(uid)
+        else:
+            self._process_buy_command(uid, params)
 
-                # let's gooooo
-                self._process_attack_command(uid, params)
+    def check_for_new_players(self):
+        """
+        check to see if any new connections arrived since last update
+        """
+        # go through any newly connected players
+        for pid in self._mud.get_new_players():
+            self.new_player(pid)
 
-            elif command in ["experience", "xp"]:
+    def check_for_disconnected_players(self):
+        """
+        check to see if anyone disconnected since last update
+        """
+        for uid in self._mud.get_disconnected_players():
+            self.player_left(uid)
 
-                # let's gooooo
-                self._process_experience_command(uid)
+    def check_for_new_commands(self):
+        """
+        check to see if any new commands are on the queue
+        """
+        for uid, command, params in self._mud.get_commands():
+            self.new_command(uid, command, params)
 
-            elif command in ["stats", "st"]:
+    def _everyone_in(self, room, exclude=None):
+        """
+        the ids of the players in a room, except 'exclude'
+        """
+        return [pid for pid, player in self._players.items()
+                if player["room"] == room and pid != exclude]
 
-                # let's gooooo
-                self._process_stats_command(uid)
+    def _everyone(self, exclude=None):
+        """
+        the ids of the players in the game, except 'exclude'
+        """
+        return [pid for pid in self._players if pid != exclude]
 
-            elif command in ["health", "hp"]:
+    def _monsters_here(self, room):
+        monsters_here = []
+        for _, monster in self._monsters.items():
+            if monster["room"] == room:
+                monsters_here.append(monster)
 
-                # let's gooooo
-                self._process_health_command(uid)
+        return bool(monsters_here)
 
-            elif command in ["ring", "r"] and params in ["gong", "g"]:
+    def _find_lairs(self):
+        """ the rooms that are lairs, by where they are """
+        lairs = {}
 
-                # let's gooooo
-                self._process_ring_gong(uid)
+        for z_coord, level in enumerate(self._grid):
+            for y_coord, row in enumerate(level):
+                for x_coord, room_num in enumerate(row):
+                    if "lair" in self._rooms[z_coord][room_num]:
+                        lair = self._rooms[z_coord][room_num]
+                        room = (z_coord, y_coord, x_coord)
+                        lairs.update({room: lair})
 
-            # 'list' command
-            elif command == "list":
+        return lairs
 
-                # go to another rooms
-                if params:
-                    self._process_list_at_command(uid, params)
-                else:
-                    self._process_list_command(uid)
+    def _arm_lair(self, room):
+        """
+        if room is a lair and nobody is left in it, set it to respawn ten
+        ticks after its last monster died
+        """
+        room = tuple(room)
+        if room not in self._lairs or self._monsters_here(list(room)):
+            return
 
-            # 'list' command
-            elif command == "buy":
+        self._lair_timers.call_at(
+            self._lairs[room]["spawn_timer"] + self._tick * 10, room,
+            lambda: self._populate_lair(room))
 
-                # go to another rooms
-                if "training" in params:
-                    self._process_train_command(uid)
-                else:
-                    self._process_buy_command(uid, params)
+    def _populate_lair(self, room):
+        """ a lair's timer went off, fill it up again """
+        # something else turned up in the meantime. The lair is set again
+        # once that dies
+        if self._monsters_here(list(room)):
+            return
 
-            # 'list' command
-            elif command == "sell":
+        lair = self._lairs[room]
+        for _ in range(lair["num"]):
+            self._spawn_monsters(
+                self._spawning.choice(lair["mobs"]), list(room))
 
-                # go to another rooms
-                self._process_sell_command(uid, params)
+    def check_for_lairs(self):
+        """
+        spawn monsters in empty lairs
+        """
+        self._lair_timers.run_due()
+        self._events.flush()
 
-            elif command == "inv":
+    def check_for_monsters(self):
+        """
+        let the monsters that are due attack and move around
+        """
+        self._monster_timers.run_due()
 
-                # go to another rooms
-                self._process_inv_command(uid)
+    def _arm_timers(self):
+        """
+        set the timers for the world as it is, e.g. after a restore
+        """
+        # which rooms are lairs doesn't change, only what is in them
+        self._lairs = self._find_lairs()
+        for room in self._lairs:
+            self._arm_lair(room)
 
-            elif command == "equip":
+        for mid in self._monsters:
+            self._wake_monster(mid)
 
-                # go to another rooms
-                self._process_equip_command(uid, params)
+        for pid in self._players:
+            self._arm_status(pid)
 
-            elif command == "drop":
+    def _monster_has_target(self, mid):
+        """
+        whether there is anyone in the monster's room it would fight
+        """
+        monster = self._monsters[mid]
+        kind = monster["name"].split(" ")[-1]
 
-                # go to another rooms
-                self._process_drop_command(uid, params)
+        for player in self._players.values():
+            if player["room"] == monster["room"]:
+                return True
 
-            elif command == "get":
+        for tid, target in self._monsters.items():
+            if target["room"] == monster["room"] and tid != mid \
+                    and target["name"].split(" ")[-1] != kind:
+                return True
 
-                # go to another rooms
-                self._process_get_command(uid, params)
+        return False
 
-            elif command == "learn":
+    def _wake_monster(self, mid):
+        """
+        give a monster its turn once it has rested, unless it already has one
+        coming or has nobody to fight
+        """
+        if mid in self._monster_timers or not self._monster_has_target(mid):
+            return
 
-                # go to another rooms
-                self._process_learn_command(uid, params)
+        self._monster_timers.call_at(
+            self._monsters[mid]["fatigue"] + self._tick, mid,
+            lambda: self._monster_turn(mid))
 
-            elif command == "cast":
+    def _wake_monsters(self, room):
+        """
+        someone just showed up in room, so the monsters there take notice
+        """
+        for mid, monster in self._monsters.items():
+            if monster["room"] == room:
+                self._wake_monster(mid)
 
-                # go to another rooms
-                self._process_cast_command(uid, params)
+    def _monster_turn(self, mid):
+        """
+        a monster's timer went off
+        """
+        if mid not in self._monsters:
+            return
 
-            # 'exit' command
-            elif command == "quit":
+        # monsters attack first and ask questions later. Whoever saw it hears
+        # about it before the next monster has a go
+        self._monsters_attack(mid)
+        self._events.flush()
+
+        # monsters wander if no one is around and run if they are injured
+        self._monsters_move()
+
+        # they keep at it for as long as there is someone to fight. The ones
+        # left with nobody sleep until someone walks in on them
+        if mid in self._monsters and self._monster_has_target(mid):
+            self._monster_timers.call_at(
+                max(self._monsters[mid]["fatigue"] + self._tick,
+                    self._now() + self._monster_retry),
+                mid, lambda: self._monster_turn(mid))
+
+    def save_state(self):
+        """
+        everything about the world that changes while the game runs, in a
+        form that can be pickled
+        """
+        return {
+            "players": self._players,
+            "monsters": self._monsters,
+            "nextid": self._nextid,
+            "rooms": self._rooms,
+            "doors": self._door.doors,
+            "traps": self._trap.traps,
+            "queues": {uid: list(queue) for uid, queue in self._queues.items()},
+            "turns": list(self._turns),
+        }
 
-                # go to another rooms
-                self._process_quit_command(uid)
+    def restore_state(self, state):
+        """
+        pick up the world where save_state left it
+        """
+        self._players = state["players"]
+        self._monsters = state["monsters"]
+        self._nextid = state["nextid"]
+        self._rooms = self._room.rooms = state["rooms"]
+        self._door.doors = state["doors"]
+        self._trap.traps = state["traps"]
+        self._queues = {
+            uid: deque(queue) for uid, queue in state["queues"].items()}
+        self._turns = deque(state["turns"])
+        if self._renderer is not None:
+            for pid in self._players:
+                self._events.subscribe(pid, self._renderer)
 
-            # some other, unrecognised command
-            else:
-                # send back an 'unknown command' message
+        # the old timers were for the old world
+        self._lair_timers = Scheduler(self._now)
+        self._monster_timers = Scheduler(self._now)
+        self._status_timers = Scheduler(self._now)
+        self._arm_timers()
 
-                self._process_unknown_command(uid, command, params)
+    def lair_deadline(self):
+        """
+        when check_for_lairs next has something to do
+        """
+        return self._lair_timers.next_deadline()
 
-    def _monsters_here(self, room):
-        monsters_here = []
-        for _, monster in self._monsters.items():
-            if monster["room"] == room:
-                monsters_here.append(monster)
+    def monster_deadline(self):
+        """
+        when check_for_monsters next has something to do, None for never
+        """
+        return self._monster_timers.next_deadline()
 
-        return bool(monsters_here)
+    def status_deadline(self):
+        """
+        when check_for_status next has something to do, None for never
+        """
+        return self._status_timers.next_deadline()
 
-    def _populate_lairs(self):
-        """ check for all rooms that are lairs and populate them """
-        lairs = {}
+    def next_deadline(self):
+        """
+        when the game next has something to do without any player input
+        """
+        deadlines = [
+            timers.next_deadline() for timers in (
+                self._lair_timers, self._monster_timers,
+                self._status_timers)
+        ]
+        # queued commands are due straight away
+        if self._queues:
+            deadlines.append(self._now())
 
-        for z_coord, level in enumerate(self._grid):
-            for y_coord, row in enumerate(level):
-                for x_coord, room_num in enumerate(row):
-                    if "lair" in self._rooms[z_coord][room_num]:
-                        lair = self._rooms[z_coord][room_num]
-                        room = (z_coord, y_coord, x_coord)
-                        lairs.update({room: lair})
+        return min((x for x in deadlines if x is not None),
+                   default=self._now() + self._tick)
 
-        if not lairs:
+    def _arm_status(self, pid):
+        """
+        set the player's timer for when they next regenerate or one of their
+        conditions comes or goes
+        """
+        player = self._players[pid]
+        if player["class"] is None:
+            self._status_timers.cancel(pid)
             return
 
-        for lroom, llair in lairs.items():
+        deadline = player["regen_hp"] + self._tick
+        for condition in player["conditions"]:
+            change = self._condition.next_change(condition)
+            if change is not None:
+                deadline = min(deadline, change)
 
-            if self._monsters_here(list(lroom)):
-                continue
+        self._status_timers.call_at(
+            deadline, pid, lambda: self._status_turn(pid))
+
+    def _status_turn(self, pid):
+        """
+        a player's timer went off
+        """
+        if pid not in self._players:
+            return
 
-            for _ in range(llair["num"]):
-                if time.time() - llair["spawn_timer"] \
-                        > self._tick * 10:
-                    self._spawn_monsters(
-                        random.choice(llair["mobs"]), list(lroom))
+        player = self._players[pid]
+        self._condition.check_condition(player)
+        self._regenerate(pid)
+        self._arm_status(pid)
 
-    def check_for_monsters(self):
+    def check_for_status(self):
         """
-        spawn monsters and move them around
+        regenerate players and keep their conditions up to date
         """
+        self._status_timers.run_due()
 
-        # only try to populate lairs every 6s or so
-        if time.time() - self._monster.populate > self._tick:
 
-            # populate lairs
-            self._populate_lairs()
+async def async_main(args):
+    """
+    game loop driven by the asyncio server
+    args: parsed command line
+    returns: none
+    """
+
+    # start the server
+    mud = AsyncMud(output_limit=args.output_limit, overflow=args.overflow,
+                   idle_timeout=args.idle_timeout, max_lines=args.max_lines,
+                   max_queued=args.max_queued,
+                   backlog=args.backlog, max_accepts=args.max_accepts,
+                   reuse_port=args.reuse_port, compress=args.compress,
+                   rate_policy=args.rate_policy)
+    await mud.start()
+    refuse_upgrades()
+
+    # create and instance of the game, and have the server hand it events
+    game = Game(mud, actions_per_round=args.actions_per_round,
+                max_actions_per_tick=args.max_actions_per_tick or None,
+                max_queued_actions=args.max_queued_actions)
+    mud.on_new_player(game.new_player)
+    mud.on_player_left(game.player_left)
+    mud.on_command(game.new_command)
+
+    timeout = 0
+    next_stats = time.time()
+    while True:
 
-            # reset populate timer
-            self._monster.populate = time.time()
+        # sleep until a player does something or the game has something due
+        await mud.wait(timeout)
 
-        monsters = self._monsters.copy()
+        mud.update()
 
-        for mid, _ in monsters.items():
+        game.check_for_lairs()
 
-            # monsters attack first and ask questions later
-            self._monsters_attack(mid)
+        game.check_for_monsters()
 
-            # monsters wander if no one is around and run if they are injured
-            self._monsters_move()
+        # new players, disconnected players and new commands
+        mud.dispatch_events()
 
-    def check_for_status(self):
-        """
-        spawn monsters and move them around
-        """
+        # a round of everyone's commands
+        game.run_commands()
 
-        for pid, player in self._players.items():
+        game.check_for_status()
 
-            if player["name"] is None:
-                continue
+        # send everything the game had to say this tick
+        mud.flush()
 
-            # monsters attack first and ask questions later
-            self._condition.check_condition(player)
+        if args.stats_interval > 0 and time.time() >= next_stats:
+            log_connections(mud)
+            next_stats = time.time() + args.stats_interval
 
-            # monsters wander if no one is around and run if they are injured
-            self._regenerate(pid)
+        timeout = max(0, game.next_deadline() - time.time())
 
 
-def main():
+def add_phases(ticker, mud, game, args):
     """
-    function main
-    args: none
+    set up the phases of the game loop
+    args: the ticker, the server, the game and the parsed command line
     returns: none
     """
+    # the game loop is a fixed timestep, each phase running at its own rate.
+    # The network phase collects what the players did and the events phase
+    # hands it to the game, so both go at the same rate. The commands phase
+    # then gives every player a turn at running what they queued, and
+    # whatever the tick had to say goes out in the output phase at the end.
+    # The game's own phases only run once their timers are due. When the
+    # ticker's sleep notices a player typing, the phases handling it run
+    # right away rather than on the next network tick
+    ticker.add_phase("network", mud.update, args.net_rate, wake=True)
+    ticker.add_phase("lairs", game.check_for_lairs, args.lair_rate,
+                     deadline=game.lair_deadline)
+    ticker.add_phase("monsters", game.check_for_monsters, args.ai_rate,
+                     deadline=game.monster_deadline)
+    ticker.add_phase("events", mud.dispatch_events, args.net_rate,
+                     wake=True)
+    ticker.add_phase("commands", game.run_commands, args.net_rate,
+                     wake=True)
+    # conditions like being too tired to attack wear off at a set moment,
+    # so unless told otherwise status keeps up with the network
+    ticker.add_phase("status", game.check_for_status,
+                     args.status_rate or args.net_rate,
+                     deadline=game.status_deadline)
+    ticker.add_phase("output", mud.flush, args.net_rate, wake=True)
+
+
+def replay_main(args):
+    """
+    play a recorded session back on a virtual clock, as fast as we can
+    args: parsed command line
+    returns: none
+    """
+    header, events = replay.load(args.replay)
+
+    # the same seed, the same start time and the same ticks give the game
+    # the same random numbers and timers the recorded one had
+    clock = VirtualClock(header["start"])
+    mud = ReplayMud(events, clock)
+    game = Game(mud, actions_per_round=args.actions_per_round,
+                max_actions_per_tick=args.max_actions_per_tick or None,
+                max_queued_actions=args.max_queued_actions,
+                sim=Sim(header["seed"], clock))
+    mud.on_new_player(game.new_player)
+    mud.on_player_left(game.player_left)
+    mud.on_command(game.new_command)
+
+    # sleeping only moves the virtual clock on, to the next recorded tick
+    ticker = Ticker(clock=clock, sleep=mud.sleep)
+    add_phases(ticker, mud, game, args)
+
+    started = time.perf_counter()
+    ticker.run(mud.finished)
+    mud.flush()
+    elapsed = time.perf_counter() - started
+
+    print(f"replayed {clock() - header['start']:.1f}s of play in "
+          f"{elapsed:.3f}s")
+    print(f"output: {mud.bytes_out} bytes, sha256 {mud.digest()}")
+    for name, stats in ticker.get_stats().items():
+        print(f"{name:>10}: {stats['runs']:7} runs, "
+              f"{stats['seconds'] * 1000:9.1f}ms, "
+              f"slowest {stats['slowest'] * 1000:7.2f}ms")
+    mud.shutdown()
+
+
+def log_connections(mud):
+    """
+    print how many players are connected and how the accepting is going
+    args: the server
+    returns: none
+    """
+    stats = mud.get_stats()
+    pending = stats["pending"]
+    print(f"connections: {stats['connected']} connected, "
+          f"{'?' if pending is None else pending} waiting to be accepted, "
+          f"{stats['accepted']} accepted, "
+          f"{stats['accepts_deferred']} times more were left for later")
 
-    # start the server
-    mud = Mud()
-
-    # create and instance of the game
-    game = Game(mud)
-
-    # main game loop. We loop forever (i.e. until the program is terminated)
-    while True:
 
-        # pause for 1/5 of a second on each loop, so that we don't constantly
-        # use 100% CPU time
-        time.sleep(0.2)
+def refuse_upgrades():
+    """
+    have SIGUSR2 say it can't upgrade this kind of server, rather than
+    kill the process and everyone connected to it
+    args: none
+    returns: none
+    """
+    if hasattr(signal, "SIGUSR2"):
+        signal.signal(
+            signal.SIGUSR2, lambda signum, frame: print(
+                "hot upgrade not supported in this mode"))
 
-        # 'update' must be called in the loop to keep the game running and give
-        # us up-to-date information
-        mud.update()
 
-        game.check_for_monsters()
+def hand_over(mud, game):
+    """
+    pass the running game on to a fresh copy of this program
+    args: the server and the game
+    returns: whether the new copy took over
+    """
+    # start it with the same options we were started with
+    argv = [sys.executable]
+    skip = False
+    for arg in sys.argv:
+        if skip or arg == "--resume-fd":
+            skip = not skip
+            continue
+        argv.append(arg)
+
+    channel, process = upgrade.start_successor(argv)
+    state, sockets = mud.handoff()
+    if upgrade.send_state(channel, {"mud": state, "game": game.save_state()},
+                          sockets):
+        return True
+
+    # it never said it was ready, so we keep going ourselves
+    print("upgrade failed, carrying on")
+    process.kill()
+    process.wait()
+    channel.close()
+    return False
 
-        game.check_for_new_players()
 
-        game.check_for_disconnected_players()
+def main():
+    """
+    function main
+    args: none
+    returns: none
+    """
+    parser = argparse.ArgumentParser(description="tgamud server")
+    parser.add_argument(
+        "--asyncio", action="store_true",
+        help="serve telnet connections from an asyncio event loop")
+    parser.add_argument(
+        "--output-limit", type=int, default=65536,
+        help="bytes of unsent output allowed to pile up for one client")
+    parser.add_argument(
+        "--overflow", choices=["drop", "truncate", "disconnect"],
+        default="drop",
+        help="what to do with a client whose output passes the limit")
+    parser.add_argument(
+        "--idle-timeout", type=int, default=30 * 60,
+        help="disconnect players who send nothing for this many seconds, "
+             "0 to never")
+    parser.add_argument(
+        "--max-lines", type=int, default=10,
+        help="most commands one player gets to run per update")
+    parser.add_argument(
+        "--max-queued", type=int, default=100,
+        help="most lines one player may have waiting to run, more are "
+             "thrown away")
+    parser.add_argument(
+        "--backlog", type=int, default=128,
+        help="connections the kernel may queue before we accept them")
+    parser.add_argument(
+        "--max-accepts", type=int, default=64,
+        help="most new connections accepted per update")
+    parser.add_argument(
+        "--gateways", type=int, default=0,
+        help="gateway processes doing the telnet work, 0 to do it ourselves")
+    parser.add_argument(
+        "--reuse-port", action="store_true",
+        help="let the kernel spread connections over the gateways' own "
+             "SO_REUSEPORT sockets instead of sharing one")
+    parser.add_argument(
+        "--threaded", action="store_true",
+        help="do the network work on a thread of its own")
+    parser.add_argument(
+        "--no-compress", dest="compress", action="store_false",
+        help="don't offer MCCP2 compression to clients")
+    parser.add_argument(
+        "--rate-policy", choices=["queue", "reject"], default="queue",
+        help="what to do with commands sent faster than their rate limit")
+    parser.add_argument(
+        "--net-rate", type=float, default=20,
+        help="times a second we read from, run commands for and write to "
+             "the players")
+    parser.add_argument(
+        "--ai-rate", type=float, default=1,
+        help="times a second monsters get to act")
+    parser.add_argument(
+        "--status-rate", type=float,
+        help="times a second players regenerate and their conditions "
+             "change, the net rate if not given")
+    parser.add_argument(
+        "--lair-rate", type=float, default=1,
+        help="times a second empty lairs are checked for respawns")
+    parser.add_argument(
+        "--actions-per-round", type=int, default=1,
+        help="commands each player gets to run per round")
+    parser.add_argument(
+        "--max-actions-per-tick", type=int, default=0,
+        help="most commands run per round in all, 0 for no limit")
+    parser.add_argument(
+        "--max-queued-actions", type=int, default=20,
+        help="most commands one player may have waiting for their turn, "
+             "more are thrown away")
+    parser.add_argument(
+        "--seed", type=int, default=None,
+        help="seed the game's random numbers, so it plays out the same way")
+    parser.add_argument(
+        "--record", metavar="FILE",
+        help="write down everything that happens to the game, to replay it. "
+             "A game being recorded isn't upgraded on SIGUSR2")
+    parser.add_argument(
+        "--replay", metavar="FILE",
+        help="play a recording back as fast as possible, without sockets")
+    parser.add_argument(
+        "--watchdog", type=float, default=1.0, metavar="SECONDS",
+        help="print where the game is stuck when a tick takes longer than "
+             "this, 0 to turn it off")
+    parser.add_argument(
+        "--stats-interval", type=float, default=60, metavar="SECONDS",
+        help="print how many connections are open, waiting and accepted "
+             "this often, 0 to never")
+    parser.add_argument("--resume-fd", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.replay:
+        return replay_main(args)
+
+    if args.asyncio:
+        # the event loop accepts as many connections at a time as the
+        # backlog holds, there is no limit of our own to set
+        if args.max_accepts != parser.get_default("max_accepts"):
+            parser.error("--max-accepts doesn't apply to --asyncio, "
+                         "use --backlog")
+        return asyncio.run(async_main(args))
 
-        game.check_for_new_commands()
+    # start the server
+    options = dict(output_limit=args.output_limit, overflow=args.overflow,
+                   idle_timeout=args.idle_timeout, max_lines=args.max_lines,
+                   max_queued=args.max_queued,
+                   backlog=args.backlog, max_accepts=args.max_accepts,
+                   reuse_port=args.reuse_port, compress=args.compress,
+                   rate_policy=args.rate_policy)
+
+    # we're taking over from a copy that got SIGUSR2, sockets and all
+    resume = None
+    if args.resume_fd is not None:
+        resume = socket.socket(fileno=args.resume_fd)
+        state, sockets = upgrade.receive_state(resume)
+        options["listen_socket"] = sockets[0]
+
+    if args.gateways:
+        mud = GatewayMud(gateways=args.gateways, **options)
+    elif args.threaded:
+        mud = ThreadedMud(**options)
+    else:
+        mud = Mud(**options)
+
+    # a recording is only any good with a seed to replay it with
+    seed = args.seed
+    if args.record and seed is None:
+        seed = time.time_ns()
+
+    # the game reads the time once per tick, when it starts, and everything
+    # in the tick happens at that moment. Given the ticks' times, which a
+    # recording keeps, it plays out the same way again
+    clock = TickClock()
+
+    # create and instance of the game, and have the server hand it events
+    game = Game(mud, actions_per_round=args.actions_per_round,
+                max_actions_per_tick=args.max_actions_per_tick or None,
+                max_queued_actions=args.max_queued_actions,
+                sim=Sim(seed, clock))
+    handlers = game
+    recorder = None
+    if args.record:
+        handlers = recorder = replay.Recorder(args.record, game, seed, clock)
+    mud.on_new_player(handlers.new_player)
+    mud.on_player_left(handlers.player_left)
+    mud.on_command(handlers.new_command)
+
+    if resume is not None:
+        mud.restore(state["mud"], sockets[1:])
+        game.restore_state(state["game"])
+        upgrade.confirm(resume)
+        print("took over from the previous process")
+
+    # in between ticks we wait on the sockets, so a command runs as soon as
+    # it arrives instead of on the next network tick. The wait is counted
+    # from when the tick started, and a new one starts when it's over
+    def sleep(timeout):
+        woke = mud.wait(clock.remaining(timeout))
+        now = clock.tick()
+        if recorder is not None:
+            recorder.tick(now, woke)
+        return woke
+
+    ticker = Ticker(clock=clock, sleep=sleep)
+    add_phases(ticker, mud, game, args)
+    if args.stats_interval > 0:
+        ticker.add_phase("stats", lambda: log_connections(mud),
+                         1 / args.stats_interval)
+
+    # a thread of its own that prints the game thread's stack when a tick
+    # stalls, to find out where the time goes on the odd slow tick
+    if args.watchdog > 0:
+        Watchdog(ticker, args.watchdog).start()
+
+    # SIGUSR2 hands everything over to a fresh copy of this program, which
+    # is how a new version goes live without anyone being disconnected. The
+    # signal only sets a flag, which the ticker looks at between ticks
+    upgrade_requested = []
+    if type(mud) is Mud:
+        if hasattr(signal, "SIGUSR2"):
+            signal.signal(
+                signal.SIGUSR2,
+                lambda signum, frame: upgrade_requested.append(signum))
+    else:
+        refuse_upgrades()
 
-        game.check_for_status()
+    # main game loop. We loop forever (i.e. until the program is terminated)
+    while True:
+        ticker.run(lambda: upgrade_requested)
+
+        upgrade_requested.clear()
+
+        # a recording only replays if one process played all of it, from
+        # the seed it was started with, so a game being recorded carries
+        # on as it is
+        if recorder is not None:
+            print(f"not upgrading while recording to {args.record}")
+            continue
+        if hand_over(mud, game):
+            return 0
 
     return 0
 
@@ -0,0 +1,46 @@
+""" tests for finding commands by what players type """
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from lib.command import Commands  # noqa: E402
+
+
+class FindTest(unittest.TestCase):
+    """ names, aliases and abbreviations """
+
+    def setUp(self):
+        self.commands = Commands()
+        noop = lambda uid, command, params: None  # noqa: E731
+        self.help = self.commands.add("help", noop, rate_class="info")
+        self.health = self.commands.add("health", noop, aliases=["hp"],
+                                        rate_class="info",
+                                        min_abbreviation=5)
+        self.north = self.commands.add("north", noop,
+                                       rate_class="movement")
+
+    def test_names_and_aliases(self):
+        self.assertIs(self.commands.find("health"), self.health)
+        self.assertIs(self.commands.find("hp"), self.health)
+
+    def test_unique_abbreviation(self):
+        self.assertIs(self.commands.find("nor"), self.north)
+        self.assertIs(self.commands.find("hel"), self.help)
+
+    def test_too_short(self):
+        self.assertIsNone(self.commands.find("no"))
+
+    def test_heal_is_not_health(self):
+        self.assertIsNone(self.commands.find("heal"))
+        self.assertIsNone(self.commands.find("hea"))
+        self.assertIs(self.commands.find("healt"), self.health)
+        classes = self.commands.rate_classes()
+        self.assertNotIn("heal", classes)
+        self.assertEqual(classes["healt"], "info")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+""" tests for running timers when they are due """
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from lib.scheduler import Scheduler  # noqa: E402
+
+
+class RunDueTest(unittest.TestCase):
+    """ what run_due calls, and when """
+
+    def setUp(self):
+        self.now = 100.0
+        self.scheduler = Scheduler(lambda: self.now)
+        self.called = []
+
+    def _timer(self, name):
+        return lambda: self.called.append(name)
+
+    def test_soonest_first(self):
+        self.scheduler.call_at(102, "b", self._timer("b"))
+        self.scheduler.call_at(101, "a", self._timer("a"))
+        self.scheduler.call_at(200, "c", self._timer("c"))
+        self.now = 150
+        self.assertEqual(self.scheduler.run_due(), 2)
+        self.assertEqual(self.called, ["a", "b"])
+        self.assertEqual(self.scheduler.next_deadline(), 200)
+
+    def test_timers_set_while_running_wait(self):
+        def again():
+            self.called.append("again")
+            self.scheduler.call_at(self.now, "again", again)
+
+        self.scheduler.call_at(self.now, "again", again)
+        self.assertEqual(self.scheduler.run_due(), 1)
+        self.assertEqual(self.called, ["again"])
+        self.assertIn("again", self.scheduler)
+        self.assertEqual(self.scheduler.next_deadline(), self.now)
+
+        self.assertEqual(self.scheduler.run_due(), 1)
+        self.assertEqual(self.called, ["again", "again"])
+
+    def test_call_at_replaces_the_timer(self):
+        self.scheduler.call_at(101, "key", self._timer("first"))
+        self.scheduler.call_at(105, "key", self._timer("second"))
+        self.assertEqual(len(self.scheduler), 1)
+        self.assertEqual(self.scheduler.deadline("key"), 105)
+
+        self.now = 103
+        self.assertEqual(self.scheduler.run_due(), 0)
+        self.now = 105
+        self.assertEqual(self.scheduler.run_due(), 1)
+        self.assertEqual(self.called, ["second"])
+
+    def test_cancelled_timers_stay_cancelled(self):
+        self.scheduler.call_at(101, "gone", self._timer("gone"))
+        self.scheduler.call_at(102, "kept", self._timer("kept"))
+        self.scheduler.cancel("gone")
+        self.assertNotIn("gone", self.scheduler)
+        self.assertEqual(self.scheduler.next_deadline(), 102)
+
+        # one that is cancelled while it waits for the next run
+        def cancel():
+            self.called.append("cancel")
+            self.scheduler.call_at(self.now, "late", self._timer("late"))
+            self.scheduler.cancel("late")
+
+        self.scheduler.call_at(102, "cancel", cancel)
+        self.now = 110
+        self.assertEqual(self.scheduler.run_due(), 2)
+        self.assertEqual(self.scheduler.run_due(), 0)
+        self.assertEqual(self.called, ["kept", "cancel"])
+        self.assertIsNone(self.scheduler.next_deadline())
+        self.assertEqual(len(self.scheduler), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
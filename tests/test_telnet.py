@@ -0,0 +1,79 @@
+""" tests for reading lines out of telnet input, however it is split up """
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from server.mud import Mud  # noqa: E402
+
+IAC = b"\xff"
+SB = b"\xfa"
+SE = b"\xf0"
+DO = b"\xfd"
+COMPRESS2 = b"\x56"
+
+
+class ProcessSentDataTest(unittest.TestCase):
+    """ _process_sent_data fed one recv at a time """
+
+    def setUp(self):
+        self.mud = Mud(host="127.0.0.1", port=0)
+        self.client = Mud._Client(None, "", b"", 0)
+
+    def tearDown(self):
+        self.mud.shutdown()
+
+    def _feed(self, *chunks):
+        """ every message the chunks complete, through a reused buffer """
+        messages = []
+        inbuf = self.client.inbuf
+        for chunk in chunks:
+            inbuf[:len(chunk)] = chunk
+            messages += self.mud._process_sent_data(self.client, inbuf,
+                                                    len(chunk))
+        return messages
+
+    def _feed_bytewise(self, data):
+        return self._feed(*(data[i:i + 1] for i in range(len(data))))
+
+    def test_lines_in_one_chunk(self):
+        self.assertEqual(self._feed(b"look\r\nnorth\r\nsay hi"),
+                         ["look\r", "north\r"])
+        self.assertEqual(self._feed(b"\r\n"), ["say hi\r"])
+
+    def test_crlf_split_across_chunks(self):
+        self.assertEqual(self._feed(b"look\r", b"\n", b"north\r", b"\nsa",
+                                    b"y hi\r\n"),
+                         ["look\r", "north\r", "say hi\r"])
+
+    def test_command_split_across_chunks(self):
+        self.assertEqual(self._feed(b"lo" + IAC, b"\xf1ok\r\n"),
+                         ["look\r"])
+        self.assertEqual(self._feed(b"no" + IAC, DO, COMPRESS2 + b"rth\r\n"),
+                         ["north\r"])
+        self.assertTrue(self.client.mccp)
+
+    def test_subnegotiation_split_across_chunks(self):
+        data = b"lo" + IAC + SB + b"\x18\x00xterm" + IAC + SE + b"ok\r\n"
+        self.assertEqual(self._feed(data[:4], data[4:9], data[9:12],
+                                    data[12:13], data[13:]),
+                         ["look\r"])
+        self.assertEqual(self._feed_bytewise(data), ["look\r"])
+
+    def test_iac_inside_subnegotiation(self):
+        data = IAC + SB + b"\x18" + IAC + IAC + b"x" + IAC + SE + b"look\r\n"
+        self.assertEqual(self._feed_bytewise(data), ["look\r"])
+
+    def test_escaped_iac_is_text(self):
+        self.assertEqual(self._feed(b"say a" + IAC, IAC + b"b\r\n"),
+                         ["say a\xffb\r"])
+        self.assertEqual(self._feed(IAC + IAC + b"\r\n"), ["\xff\r"])
+
+    def test_backspace_across_chunks(self):
+        self.assertEqual(self._feed(b"lox", b"\x08ok\r\n"), ["look\r"])
+
+
+if __name__ == "__main__":
+    unittest.main()
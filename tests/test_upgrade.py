@@ -0,0 +1,58 @@
+""" tests for handing the server over to a new process """
+import os
+import socket
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from server import upgrade  # noqa: E402
+
+
+class HandOverTest(unittest.TestCase):
+    """ send_state against a successor that may or may not make it """
+
+    def setUp(self):
+        self.ours, self.theirs = socket.socketpair(socket.AF_UNIX,
+                                                   socket.SOCK_STREAM)
+        self.ours.settimeout(5)
+        self.passed, self.other = socket.socketpair()
+
+    def tearDown(self):
+        for sock in (self.ours, self.theirs, self.passed, self.other):
+            sock.close()
+
+    def _successor(self, confirm):
+        """ read the state like a new process would, then maybe confirm """
+        state, sockets = upgrade.receive_state(self.theirs)
+        self.received = state
+        for sock in sockets:
+            sock.close()
+        if confirm:
+            upgrade.confirm(self.theirs)
+        else:
+            # it dies before saying it took over
+            self.theirs.close()
+
+    def _hand_over(self, confirm):
+        successor = threading.Thread(target=self._successor, args=(confirm,))
+        successor.start()
+        result = upgrade.send_state(self.ours, {"players": [1, 2]},
+                                    [self.passed])
+        successor.join()
+        return result
+
+    def test_successor_takes_over(self):
+        self.assertTrue(self._hand_over(confirm=True))
+        self.assertEqual(self.received, {"players": [1, 2]})
+
+    def test_successor_dies_before_confirming(self):
+        # the old process has to hear about it and keep going, not crash
+        self.assertFalse(self._hand_over(confirm=False))
+        self.assertEqual(self.received, {"players": [1, 2]})
+
+
+if __name__ == '__main__':
+    unittest.main()